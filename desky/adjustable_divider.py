@@ -21,18 +21,19 @@ class AdjustableDividerGrabber(TextButton):
 
     def mouse_press(self, event):
         super().mouse_press(event)
-        if event.hover:
+        if event.hover and event.button == 1:
             self.grab_point = self.to_world((event.x, event.y))
+            event.gui.capture_pointer(self)
 
     def mouse_release(self, event):
         super().mouse_release(event)
-        if self.grab_point:
+        if self.grab_point and event.button == 1:
             global_pos = self.to_world((event.x, event.y))
             self.adjust(global_pos[0] - self.grab_point[0], global_pos[1] - self.grab_point[1], True)
             self.grab_point = None
+            event.gui.release_pointer()
 
-    def mouse_move(self, event):
-        super().mouse_move(event)
+    def mouse_drag(self, event):
         if self.grab_point:
             global_pos = self.to_world((event.x, event.y))
             self.adjust(global_pos[0] - self.grab_point[0], global_pos[1] - self.grab_point[1], False)
@@ -21,24 +21,39 @@ class TextButton(Label):
         self.clicked = lambda: None
         self.accept_mouse_input = True
 
-    def mouse_move(self, event):
-        if event.hover != self.hover:
-            self.hover = event.hover
-            if self.state == ButtonState.NORMAL or self.state == ButtonState.HOVER:
-                self.state = ButtonState.HOVER if event.hover else ButtonState.NORMAL
+    def mouse_enter(self, event):
+        self.hover = True
+        if self.state == ButtonState.NORMAL or self.state == ButtonState.HOVER:
+            self.state = ButtonState.HOVER
+
+    def mouse_leave(self, event):
+        self.hover = False
+        if self.state == ButtonState.NORMAL or self.state == ButtonState.HOVER:
+            self.state = ButtonState.NORMAL
 
     def mouse_press(self, event):
+        # Wheel steps arrive as buttons 4 and 5 and do not press buttons.
+        if event.button in (4, 5):
+            return
         if event.hover:
             self.state = ButtonState.PRESSED
+            # Under targeted dispatch the button needs the release even when
+            # it happens outside of it.
+            event.gui.add_global_listener(self)
 
     def mouse_release(self, event):
+        if event.button in (4, 5):
+            return
         if event.hover:
             if not self.on:
                 self.state = ButtonState.HOVER
         else:
             self.state = ButtonState.PRESSED if self.on else ButtonState.NORMAL
+        event.gui.remove_global_listener(self)
 
     def mouse_click(self, event):
+        if event.button in (4, 5):
+            return
         if event.hover:
             if self.togglable:
                 self.on = not self.on
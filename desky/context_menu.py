@@ -11,11 +11,10 @@ class ContextMenuItem(TextButton):
         self.clicked = lambda: None
         self.root_menu = None
 
-    def mouse_move(self, event):
+    def mouse_enter(self, event):
         # Remove submenu peers when we hover over this item.
-        if event.hover:
-            self.parent.remove_submenus()
-        super().mouse_move(event)
+        self.parent.remove_submenus()
+        super().mouse_enter(event)
 
     def mouse_press(self, event):
         # Run the callback and remove the entire menu system.
@@ -39,13 +38,13 @@ class ContextMenuSubItem(TextButton):
         super().__init__()
         self.submenu = None
 
-    def mouse_move(self, event):
+    def mouse_enter(self, event):
         # Remove submenu peers then show this submenu when we hover over this
         # panel.
-        if event.hover and self.submenu.is_hidden:
+        if self.submenu.is_hidden:
             self.parent.remove_submenus()
             self.submenu.show(event.gui, self.absolute_x + self.width, self.absolute_y)
-        super().mouse_move(event)
+        super().mouse_enter(event)
 
     def show(self, gui, x, y):
         self.submenu.show(gui, x, y)
@@ -71,6 +70,8 @@ class ContextMenuPanel(Panel):
         self.dock_layout = DockLayout()
         # Set when this is a submenu
         self.root_menu = None
+        # The menu is sized to fit its items.
+        self.size_to_content = True
 
     def add(self, item):
         item.parent = self
@@ -121,8 +122,13 @@ class ContextMenuPanel(Panel):
                 self.remove()
 
     def setup(self, scheme, gui):
+        # Presses outside of the menu close it.
+        gui.add_global_listener(self)
         scheme.setup_context_menu_panel(self, gui)
 
+    def measure(self, scheme, w, h):
+        return scheme.measure_context_menu_panel(self, w, h)
+
     def layout(self, scheme, w, h):
         scheme.layout_context_menu_panel(self, w, h)
 
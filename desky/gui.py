@@ -1,24 +1,71 @@
 
+import copy
+import unittest
+from contextlib import contextmanager
+from enum import Enum
+
 import pygame
 import pygame.freetype
 import pygame.scrap
 
 from desky.clock import Clock
-from desky.panel import Panel
+from desky.panel import Panel, event_handlers
+from desky.surface_pool import SurfacePool
 from desky.layout.docking import DockLayout
 from desky.scheme.scheme import Scheme
 from desky.scheme.debug import DebugScheme
 
+class DispatchMode(Enum):
+    # Every panel in the tree receives every mouse event. Key events still
+    # only travel from the focused panel up to the world.
+    BROADCAST = 1
+    # Events travel along the path to the hovered or focused panel. Mouse
+    # events also reach any global listeners.
+    TARGETED = 2
+
+class EventPhase(Enum):
+    CAPTURE = 1
+    TARGET = 2
+    BUBBLE = 3
+    GLOBAL = 4
+
 class GuiEvent:
+    """
+    GuiEvent is the base of the events the Gui sends to panels. The Gui
+    reuses event objects once they have been dispatched, so handlers that keep
+    an event must keep copy.copy(event) instead.
+    """
+
+    __slots__ = ("gui", "target", "phase", "propagation_stopped")
+
     def __init__(self):
+        self.reset()
+
+    def reset(self):
         self.gui = None
+        # Set for targeted dispatch only.
+        self.target = None
+        self.phase = None
+        self.propagation_stopped = False
+
+    def stop_propagation(self):
+        """
+        Stop a targeted event from reaching further panels along its path.
+        Global listeners still receive it.
+        """
+        self.propagation_stopped = True
 
 class MouseEvent(GuiEvent):
-    def __init__(self):
-        super().__init__()
+
+    __slots__ = ("x", "y", "button", "steps", "inside", "hover")
+
+    def reset(self):
+        super().reset()
         self.x = 0
         self.y = 0
         self.button = 0
+        # Number of wheel steps merged into this event by Gui.events().
+        self.steps = 1
         self.inside = False
         self.hover = False
 
@@ -28,37 +75,35 @@ class MouseEvent(GuiEvent):
                     self.x, self.y, self.button, self.inside, self.hover))
 
 class MouseMoveEvent(MouseEvent):
-    def __init__(self):
-        super().__init__()
+
+    __slots__ = ("delta_x", "delta_y")
+
+    def reset(self):
+        super().reset()
         self.delta_x = 0
         self.delta_y = 0
 
 class MousePressEvent(MouseEvent):
-    pass
+    __slots__ = ()
 
 class MouseReleaseEvent(MouseEvent):
-    pass
+    __slots__ = ()
 
 class MouseClickEvent(MouseEvent):
-    pass
+    __slots__ = ()
 
-class KeyPressEvent:
-    def __init__(self):
-        super().__init__()
-        self.hover = False
-        self.focus = False
-        self.uni = 0
-        self.key = 0
-        self.mod = 0
+class MouseEnterEvent(MouseEvent):
+    __slots__ = ()
 
-    def __str__(self):
-        return (type(self).__name__ +
-                "(hover={}, focus={}, uni={}, key={}, mod={})".format(
-                    self.hover, self.focus, self.uni, self.key, self.mod))
+class MouseLeaveEvent(MouseEvent):
+    __slots__ = ()
 
-class KeyReleaseEvent:
-    def __init__(self):
-        super().__init__()
+class KeyEvent(GuiEvent):
+
+    __slots__ = ("hover", "focus", "key", "mod")
+
+    def reset(self):
+        super().reset()
         self.hover = False
         self.focus = False
         self.key = 0
@@ -69,21 +114,178 @@ class KeyReleaseEvent:
                 "(hover={}, focus={}, key={}, mod={})".format(
                     self.hover, self.focus, self.key, self.mod))
 
+class KeyPressEvent(KeyEvent):
+
+    __slots__ = ("uni",)
+
+    def reset(self):
+        super().reset()
+        self.uni = 0
+
+    def __str__(self):
+        return (type(self).__name__ +
+                "(hover={}, focus={}, uni={}, key={}, mod={})".format(
+                    self.hover, self.focus, self.uni, self.key, self.mod))
+
+class KeyReleaseEvent(KeyEvent):
+    __slots__ = ()
+
+# Modifiers accelerators tell apart. Either side of the keyboard counts as
+# the same modifier and lock keys are ignored.
+accelerator_mods = (pygame.KMOD_CTRL, pygame.KMOD_SHIFT, pygame.KMOD_ALT, pygame.KMOD_META)
+
+def normalize_mod(mod):
+    normalized = 0
+    for group in accelerator_mods:
+        if mod & group:
+            normalized |= group
+    return normalized
+
+# Region containing every point, the hit region of the world panel.
+unbounded = pygame.Rect(-(1 << 29), -(1 << 29), 1 << 30, 1 << 30)
+
+def exclude_rect(region, rect, x, y):
+    # Largest part of region on the point's side of rect. Empty when rect
+    # contains the point.
+    if not region.colliderect(rect):
+        return region
+    parts = []
+    if x < rect.left:
+        parts.append(pygame.Rect(region.left, region.top, rect.left - region.left, region.height))
+    if x >= rect.right:
+        parts.append(pygame.Rect(rect.right, region.top, region.right - rect.right, region.height))
+    if y < rect.top:
+        parts.append(pygame.Rect(region.left, region.top, region.width, rect.top - region.top))
+    if y >= rect.bottom:
+        parts.append(pygame.Rect(region.left, rect.bottom, region.width, region.bottom - rect.bottom))
+    if not parts:
+        return pygame.Rect(x, y, 0, 0)
+    return max(parts, key=lambda part: part.width * part.height)
+
+# Mouse buttons pygame reports for wheel steps.
+wheel_buttons = (4, 5)
+
+def coalesce_events(events):
+    """
+    Merge consecutive mouse motion events into one with the summed relative
+    motion, and consecutive wheel steps on the same button into one press and
+    release with a steps attribute. Everything else keeps its order.
+    """
+    coalesced = []
+    merged_release = None
+    for event in events:
+        if event.type == pygame.MOUSEWHEEL:
+            # Wheel steps are handled through their button events.
+            continue
+        last = coalesced[-1] if coalesced else None
+        if (event.type == pygame.MOUSEMOTION
+                and last is not None and last.type == pygame.MOUSEMOTION):
+            # Events are rebuilt from copies of their dicts since the
+            # caller's events may be handled elsewhere too.
+            coalesced[-1] = pygame.event.Event(pygame.MOUSEMOTION, dict(event.dict,
+                    rel=(last.rel[0] + event.rel[0], last.rel[1] + event.rel[1])))
+        elif (event.type == pygame.MOUSEBUTTONDOWN and event.button in wheel_buttons
+                and len(coalesced) >= 2
+                and last.type == pygame.MOUSEBUTTONUP and last.button == event.button
+                and coalesced[-2].type == pygame.MOUSEBUTTONDOWN
+                and coalesced[-2].button == event.button):
+            # Add the step to the previous press and drop its release.
+            press = coalesced[-2]
+            coalesced[-2] = pygame.event.Event(press.type, dict(press.dict,
+                    steps=press.dict.get("steps", 1) + 1))
+            merged_release = event.button
+        elif event.type == pygame.MOUSEBUTTONUP and event.button == merged_release:
+            merged_release = None
+        else:
+            coalesced.append(event)
+    return coalesced
+
 class Gui:
 
     def __init__(self):
         self.world = Panel()
+        self.world.gui = self
         self.world.accept_mouse_input = True
         self.hover = self.world
+        # Panels from the world down to the hover panel.
+        self.hover_path = [self.world]
+        # State of the last hover search, see find_hover: the panels from the
+        # world down to the hover panel, the world space regions in which each
+        # prefix of that path and finally the hover panel itself are still
+        # hit, and the Panel.hit_generation they were found in.
+        self.hit_path = []
+        self.hit_regions = []
+        self.hit_generation = None
         self.focus = None
         self.press_panel = dict()
+        # Panel receiving all motion and release events, see capture_pointer.
+        self.pointer_capture = None
         self.scheme = Scheme()
+        self.dispatch_mode = DispatchMode.BROADCAST
+        # Panels receiving targeted events outside their path, in the order
+        # they were added.
+        self.global_listeners = dict()
+        # Panels receiving broadcast events by handler name, in the order they
+        # were added.
+        self.listeners = {name: dict() for name in event_handlers}
+        # Walks of the listeners of each event and the Panel.tree_generation
+        # they were made in, see broadcast_mouse_event.
+        self.broadcast_order = dict()
+        # Accelerator callbacks by (key, normalized modifiers), then by scope
+        # panel, None for accelerators that apply everywhere.
+        self.accelerators = dict()
+        # Dispatched events by type, ready for reuse.
+        self.event_pool = dict()
+        self.background_color = (30, 30, 30)
+        self.surface_pool = SurfacePool()
+        # Tree changes requested since the last layout, applied in order by
+        # layout(). Setups are only kept by panel since repeating one does
+        # nothing.
+        self.setup_queue = dict()
+        self.delete_queue = []
+        self.reparent_queue = []
+        self.move_queue = []
+        # Created panels waiting in the reparent queue to be added.
+        self.new_panels = set()
+        # Panels that requested layout or composite inside batch(), sent on
+        # when the outermost batch exits.
+        self.batch_depth = 0
+        self.batched_layout = dict()
+        self.batched_composite = dict()
+
+    @contextmanager
+    def batch(self):
+        """
+        Hold back the layout and composite requests panels make inside the
+        with block and send each panel's once when the outermost batch exits,
+        so setting many properties walks the ancestors once per panel.
+        """
+        self.batch_depth += 1
+        try:
+            yield
+        finally:
+            self.batch_depth -= 1
+            if self.batch_depth == 0:
+                self.flush_batch()
+
+    def flush_batch(self):
+        layout = self.batched_layout
+        composite = self.batched_composite
+        self.batched_layout = dict()
+        self.batched_composite = dict()
+        for panel in layout:
+            panel.request_layout()
+        for panel in composite:
+            panel.request_composite()
 
     def create(self, cls, *args, **kwargs):
         instance = cls(*args, **kwargs)
+        instance.gui = self
         instance._parent = self.world
-        self.world.add_child_queue.append(instance)
+        self.new_panels.add(instance)
+        self.reparent_queue.append((instance, self.world))
         instance.request_layout()
+        self.world.request_layout()
         instance.setup(self.scheme, self)
         instance.setup_dirty = False
         return instance
@@ -92,44 +294,357 @@ class Gui:
         # Determine which panel the mouse is hovering over using depth-first
         # search. Higher index children have priority. Children have priority
         # over parent.
-        self.hover = None
+        #
+        # While no panel changed, the last search is reused: the hover panel
+        # is kept while the point stays in its region, otherwise the search
+        # resumes from the deepest panel of the last path whose region still
+        # contains the point.
+        start = 0
+        if self.hit_generation == Panel.hit_generation:
+            valid = 0
+            while (valid < len(self.hit_regions)
+                    and self.hit_regions[valid].collidepoint(x, y)):
+                valid += 1
+            if valid == len(self.hit_regions):
+                return
+            start = max(valid - 1, 0)
+
+        path = self.hit_path[:start]
         def hover_dfs(panel, x, y):
+            path.append(panel)
+            for child in panel.children_at(x, y):
+                if hover_dfs(child, x - child.x, y - child.y):
+                    return True
             if panel.accept_mouse_input:
-                self.hover = panel
-            for child in panel.children:
-                if (child.rect.contains_point(x, y)
-                    and hover_dfs(child, x - child.x, y - child.y)):
-                        return True
-            return panel.accept_mouse_input
-        # These should always succeed because the world panel is clickable by
-        # default.
-        assert hover_dfs(self.world, x, y), "Hover depth-first search returned false"
-        assert self.hover != None, "Hover search did not find any panels."
+                return True
+            path.pop()
+            return False
 
-    def broadcast_mouse_event(self, event, event_name):
-        def broadcast(panel, event):
-            orig_x = event.x
-            orig_y = event.y
-            for child in panel.children:
-                event.x = orig_x - child.x
-                event.y = orig_y - child.y
-                broadcast(child, event)
-            event.x = orig_x
-            event.y = orig_y
+        if start == 0 or not hover_dfs(self.hit_path[start], *self.hit_path[start].to_local((x, y))):
+            # None of the old path is reused, so neither are its regions.
+            start = 0
+            path = []
+            # This should always succeed because the world panel is clickable
+            # by default.
+            assert hover_dfs(self.world, x, y), "Hover depth-first search returned false"
+        self.hover = path[-1]
+
+        # Regions of the unchanged part of the path are still valid.
+        regions = self.hit_regions[:start + 1] if start > 0 else [unbounded]
+        for depth in range(len(regions), len(path) + 1):
+            parent = path[depth - 1]
+            above = path[depth] if depth < len(path) else None
+            ox, oy = self.world_offset(parent)
+            region = regions[-1]
+            if above is not None:
+                region = region.clip(pygame.Rect(ox + above.x, oy + above.y, above.width, above.height))
+            # Bound the region to the index cell so that wide panels only test
+            # the children near the point.
+            cell = parent.hit_cell(x - ox, y - oy)
+            if cell is not None:
+                region = region.clip(pygame.Rect(cell).move(ox, oy))
+            # Children above the path take the point over.
+            for child in parent.children_overlapping(region.move(-ox, -oy)):
+                if child is above:
+                    break
+                region = exclude_rect(region, pygame.Rect(
+                        ox + child.x, oy + child.y, child.width, child.height), x, y)
+            regions.append(region)
+        self.hit_path = path
+        self.hit_regions = regions
+        self.hit_generation = Panel.hit_generation
+
+    def subscribe(self, panel, event_name):
+        """
+        Broadcast event_name to panel even though its class does not override
+        the handler, i.e. when the handler is assigned to the instance.
+
+        Key events follow the focus chain instead; panels subscribed to
+        key_press or key_release also receive the keys sent elsewhere, after
+        the bubble phase.
+        """
+        self.listeners[event_name][panel] = None
+        self.broadcast_order.pop(event_name, None)
+
+    def unsubscribe(self, panel, event_name):
+        self.listeners[event_name].pop(panel, None)
+        self.broadcast_order.pop(event_name, None)
+
+    def add_global_listener(self, panel):
+        """
+        Send targeted mouse events to panel even when it is not on the path
+        to the hover panel, i.e. to see presses outside of itself.
+        """
+        self.global_listeners[panel] = None
+
+    def remove_global_listener(self, panel):
+        self.global_listeners.pop(panel, None)
+
+    def acquire_event(self, cls):
+        # Events are pooled rather than kept per type so that dispatching an
+        # event from within a handler does not clobber the outer event.
+        pool = self.event_pool.get(cls)
+        if pool:
+            event = pool.pop()
+            event.reset()
+        else:
+            event = cls()
+        event.gui = self
+        return event
+
+    def release_event(self, event):
+        self.event_pool.setdefault(type(event), []).append(event)
+
+    def add_accelerator(self, key, mod, callback, *, scope=None):
+        """
+        Call callback(event) instead of dispatching presses of key with the
+        modifiers in mod. A scoped accelerator only applies while scope or one
+        of its descendants has focus and the innermost scope wins.
+        """
+        self.accelerators.setdefault((key, normalize_mod(mod)), dict())[scope] = callback
+
+    def remove_accelerator(self, key, mod, *, scope=None):
+        combo = (key, normalize_mod(mod))
+        scopes = self.accelerators.get(combo)
+        if scopes is not None:
+            scopes.pop(scope, None)
+            if not scopes:
+                del self.accelerators[combo]
+
+    def accelerate(self, event):
+        # Returns whether an accelerator handled the key press.
+        scopes = self.accelerators.get((event.key, normalize_mod(event.mod)))
+        if not scopes:
+            return False
+        panel = self.focus
+        while panel is not None:
+            if panel in scopes:
+                scopes[panel](event)
+                return True
+            panel = panel.parent
+        if None in scopes:
+            scopes[None](event)
+            return True
+        return False
+
+    def path_to(self, panel):
+        # Panels from the world down to panel.
+        path = []
+        while panel is not None:
+            path.append(panel)
+            panel = panel.parent
+        path.reverse()
+        return path
+
+    def dispatch_mouse_event(self, event, event_name):
+        if self.dispatch_mode == DispatchMode.BROADCAST:
+            self.broadcast_mouse_event(event, event_name)
+        else:
+            self.target_mouse_event(event, event_name)
+
+    def dispatch_key_event(self, event, event_name):
+        # Key events go to the focused panel and bubble up its ancestors in
+        # either mode, only targeted dispatch runs the capture phase.
+        capture = (self.dispatch_mode == DispatchMode.TARGETED)
+        self.target_key_event(event, event_name, capture=capture)
+
+    def target_event(self, event, event_name, path, prepare, listeners, *,
+            capture=True):
+        # Capture from the world down to the target's parent, then the target,
+        # then bubble back up to the world, and finally the listeners that are
+        # not on the path. prepare(panel) sets the panel specific event fields.
+        event.target = path[-1]
+        event.propagation_stopped = False
+
+        def deliver(panel, handler_name, phase):
+            prepare(panel)
+            event.phase = phase
+            getattr(panel, handler_name)(event)
+
+        for panel in path[:-1] if capture else ():
+            if event.propagation_stopped:
+                break
+            deliver(panel, event_name + "_capture", EventPhase.CAPTURE)
+        if not event.propagation_stopped:
+            deliver(path[-1], event_name, EventPhase.TARGET)
+        for panel in reversed(path[:-1]):
+            if event.propagation_stopped:
+                break
+            deliver(panel, event_name, EventPhase.BUBBLE)
+
+        on_path = set(path)
+        for panel in list(listeners):
+            if panel not in on_path:
+                deliver(panel, event_name, EventPhase.GLOBAL)
+
+    def target_mouse_event(self, event, event_name):
+        world_x = event.x
+        world_y = event.y
+
+        def prepare(panel):
+            event.x, event.y = panel.to_local((world_x, world_y))
             event.inside = (event.x >= 0 and event.y >= 0
                             and event.x < panel.width and event.y < panel.height)
             event.hover = (panel == self.hover)
-            getattr(panel, event_name)(event)
-        broadcast(self.world, event)
 
-    def broadcast_key_event(self, event, event_name):
-        def broadcast(panel, event):
-            for child in panel.children:
-                broadcast(child, event)
+        self.target_event(event, event_name, self.path_to(self.hover), prepare,
+                self.global_listeners)
+        event.x = world_x
+        event.y = world_y
+
+    def target_key_event(self, event, event_name, *, capture=True):
+        def prepare(panel):
             event.hover = (panel == self.hover)
             event.focus = (panel == self.focus)
+
+        target = self.focus
+        if target is None or self.world_offset(target) is None:
+            target = self.world
+        # Global listeners only see mouse events, panels subscribed to the key
+        # event see every key.
+        self.target_event(event, event_name, self.path_to(target), prepare,
+                self.listeners[event_name], capture=capture)
+
+    def hidden_ancestor(self, panel):
+        # The panel or the ancestor hiding it, None when the panel is shown.
+        while panel.parent is not None:
+            if not panel.visible:
+                return panel
+            panel = panel.parent
+        return None
+
+    def world_offset(self, panel):
+        # Position of the panel in world coordinates, or None when the panel
+        # or one of its ancestors is hidden.
+        x = 0
+        y = 0
+        while panel.parent is not None:
+            if not panel.visible:
+                return None
+            x += panel.x
+            y += panel.y
+            panel = panel.parent
+        return (x, y)
+
+    def capture_pointer(self, panel):
+        """
+        Send mouse motion events to panel.mouse_drag and release events to
+        panel.mouse_release, without searching for the hover panel, until
+        release_pointer() is called. Used for drags.
+        """
+        self.pointer_capture = panel
+
+    def release_pointer(self):
+        self.pointer_capture = None
+
+    def send_captured(self, event, event_name):
+        panel = self.pointer_capture
+        world_x = event.x
+        world_y = event.y
+        event.target = panel
+        event.phase = EventPhase.TARGET
+        event.x, event.y = panel.to_local((world_x, world_y))
+        event.inside = (event.x >= 0 and event.y >= 0
+                        and event.x < panel.width and event.y < panel.height)
+        event.hover = (panel == self.hover)
+        getattr(panel, event_name)(event)
+        event.x = world_x
+        event.y = world_y
+
+    def update_hover(self, x, y):
+        # Find the new hover panel and send mouse_leave to the panels no
+        # longer on the hover path, deepest first, then mouse_enter to the
+        # panels new to it, top down.
+        self.find_hover(x, y)
+        path = self.path_to(self.hover)
+        common = 0
+        while (common < len(path) and common < len(self.hover_path)
+                and path[common] is self.hover_path[common]):
+            common += 1
+        left = self.hover_path[common:]
+        self.hover_path = path
+
+        def send(panel, event, event_name):
+            event.x, event.y = panel.to_local((x, y))
+            event.inside = (event.x >= 0 and event.y >= 0
+                            and event.x < panel.width and event.y < panel.height)
+            event.hover = (panel == self.hover)
+            getattr(panel, event_name)(event)
+
+        if left:
+            event = self.acquire_event(MouseLeaveEvent)
+            for panel in reversed(left):
+                send(panel, event, "mouse_leave")
+            self.release_event(event)
+        if common < len(path):
+            event = self.acquire_event(MouseEnterEvent)
+            for panel in path[common:]:
+                send(panel, event, "mouse_enter")
+            self.release_event(event)
+
+    def broadcast_walk(self, event_name):
+        # The part of the tree holding listeners of event_name: the panels in
+        # pre-order with the position of their parent, and the positions of
+        # the listeners in post-order, children before their parents and
+        # panels higher in the z-order first.
+        listeners = self.listeners[event_name]
+        branches = set()
+        for panel in listeners:
+            while panel is not None and panel not in branches:
+                branches.add(panel)
+                panel = panel.parent
+        nodes = []
+        delivery = []
+        def walk(panel, parent_index):
+            index = len(nodes)
+            nodes.append((panel, parent_index))
+            for child in panel.children:
+                if child in branches:
+                    walk(child, index)
+            if panel in listeners:
+                delivery.append(index)
+        walk(self.world, -1)
+        return (nodes, delivery)
+
+    def broadcast_mouse_event(self, event, event_name):
+        # Listeners receive the event in tree order whatever order they were
+        # registered in. The walk is cached until the tree structure or the
+        # listeners change, offsets are accumulated along it on every event.
+        order = self.broadcast_order.get(event_name)
+        if order is None or order[0] != Panel.tree_generation:
+            order = (Panel.tree_generation, self.broadcast_walk(event_name))
+            self.broadcast_order[event_name] = order
+        nodes, delivery = order[1]
+        # Offsets in world coordinates, None for hidden panels.
+        offsets = [(0, 0)]
+        append = offsets.append
+        for panel, parent_index in nodes[1:]:
+            offset = offsets[parent_index]
+            if offset is not None and panel._visible:
+                rect = panel._rect
+                offset = (offset[0] + rect.x, offset[1] + rect.y)
+            else:
+                offset = None
+            append(offset)
+
+        world_x = event.x
+        world_y = event.y
+        hover = self.hover
+        for index in delivery:
+            offset = offsets[index]
+            if offset is None:
+                continue
+            panel = nodes[index][0]
+            rect = panel._rect
+            x = world_x - offset[0]
+            y = world_y - offset[1]
+            event.x = x
+            event.y = y
+            event.inside = 0 <= x < rect.w and 0 <= y < rect.h
+            event.hover = panel is hover
             getattr(panel, event_name)(event)
-        broadcast(self.world, event)
+        event.x = world_x
+        event.y = world_y
 
     def set_focus(self, panel):
         if self.focus is not None:
@@ -137,22 +652,33 @@ class Gui:
         self.focus = panel
         panel.focus_change(True)
 
+    def events(self, events):
+        """
+        Handle a frame's worth of pygame events, merging mouse motion and
+        wheel steps so that each is dispatched at most once per run.
+        """
+        for event in coalesce_events(events):
+            self.event(event)
+
     def event(self, event):
         if event.type == pygame.MOUSEMOTION:
-            # Determine new hover panel.
-            self.find_hover(*event.pos)
-
-            # Dispatch a mouse move event.
-            gui_event = MouseMoveEvent()
-            gui_event.gui = self
+            gui_event = self.acquire_event(MouseMoveEvent)
             gui_event.x = event.pos[0]
             gui_event.y = event.pos[1]
             gui_event.delta_x = event.rel[0]
             gui_event.delta_y = event.rel[1]
-            self.broadcast_mouse_event(gui_event, "mouse_move")
+            if self.pointer_capture is not None:
+                self.send_captured(gui_event, "mouse_drag")
+            else:
+                # Determine new hover panel.
+                self.update_hover(*event.pos)
+
+                # Dispatch a mouse move event.
+                self.dispatch_mouse_event(gui_event, "mouse_move")
+            self.release_event(gui_event)
         elif event.type == pygame.MOUSEBUTTONDOWN:
             # Determine new hover panel.
-            self.find_hover(*event.pos)
+            self.update_hover(*event.pos)
             # Remember that this hover panel has been pressed.
             self.press_panel[event.button] = self.hover
 
@@ -161,96 +687,71 @@ class Gui:
             self.set_focus(self.hover)
 
             # Dispatch a mouse press event.
-            gui_event = MousePressEvent()
-            gui_event.gui = self
+            gui_event = self.acquire_event(MousePressEvent)
             gui_event.x = event.pos[0]
             gui_event.y = event.pos[1]
             gui_event.button = event.button
-            self.broadcast_mouse_event(gui_event, "mouse_press")
+            gui_event.steps = getattr(event, "steps", 1)
+            self.dispatch_mouse_event(gui_event, "mouse_press")
+            self.release_event(gui_event)
         elif event.type == pygame.MOUSEBUTTONUP:
-            # Determine new hover panel.
-            self.find_hover(*event.pos)
-
-            # Dispatch a mouse release event.
-            gui_event = MouseReleaseEvent()
-            gui_event.gui = self
+            gui_event = self.acquire_event(MouseReleaseEvent)
             gui_event.x = event.pos[0]
             gui_event.y = event.pos[1]
             gui_event.button = event.button
-            self.broadcast_mouse_event(gui_event, "mouse_release")
+            gui_event.steps = getattr(event, "steps", 1)
+            if self.pointer_capture is not None:
+                self.send_captured(gui_event, "mouse_release")
+                # The hover panel was not tracked during the capture.
+                if self.pointer_capture is None:
+                    self.update_hover(*event.pos)
+            else:
+                # Determine new hover panel.
+                self.update_hover(*event.pos)
+
+                # Dispatch a mouse release event.
+                self.dispatch_mouse_event(gui_event, "mouse_release")
+            self.release_event(gui_event)
 
             # Get the hover panel that received the last press event.
             press_panel = self.press_panel.get(event.button, None)
             self.press_panel[event.button] = None
             # Determine if the panel was clicked on.
-            if press_panel == self.hover:
+            if self.pointer_capture is None and press_panel == self.hover:
                 # Dispatch a mouse click event.
-                gui_event = MouseClickEvent()
-                gui_event.gui = self
+                gui_event = self.acquire_event(MouseClickEvent)
                 gui_event.x = event.pos[0]
                 gui_event.y = event.pos[1]
                 gui_event.button = event.button
-                self.broadcast_mouse_event(gui_event, "mouse_click")
+                gui_event.steps = getattr(event, "steps", 1)
+                self.dispatch_mouse_event(gui_event, "mouse_click")
+                self.release_event(gui_event)
         elif event.type == pygame.KEYDOWN:
             # Dispatch a key press event.
-            gui_event = KeyPressEvent()
-            gui_event.gui = self
+            gui_event = self.acquire_event(KeyPressEvent)
             gui_event.uni = event.unicode
             gui_event.key = event.key
             gui_event.mod = event.mod
-            self.broadcast_key_event(gui_event, "key_press")
+            if not self.accelerate(gui_event):
+                self.dispatch_key_event(gui_event, "key_press")
+            self.release_event(gui_event)
         elif event.type == pygame.KEYUP:
             # Dispatch a key release event.
-            gui_event = KeyReleaseEvent()
-            gui_event.gui = self
+            gui_event = self.acquire_event(KeyReleaseEvent)
             gui_event.key = event.key
             gui_event.mod = event.mod
-            self.broadcast_key_event(gui_event, "key_release")
+            self.dispatch_key_event(gui_event, "key_release")
+            self.release_event(gui_event)
 
     def layout(self, window_width, window_height):
-
-        def setup(pnl):
-            for child in pnl.children:
-                setup(child)
-            if pnl.setup_dirty:
-                pnl.setup(self.scheme, self)
-                pnl.setup_dirty = False
-
-        setup(self.world)
-
-        def remove_children(pnl):
-            children = list()
-            for child in pnl.children:
-                if not child.marked_for_deletion:
-                    remove_children(child)
-                    children.append(child)
-                else:
-                    pnl.request_layout()
-            pnl.children = children
-
-        remove_children(self.world)
-
-        def add_children(pnl):
-            # Add a new child.
-            if len(pnl.add_child_queue) > 0:
-                pnl.request_layout()
-                for child in pnl.add_child_queue:
-                    # Remove child from old parent
-                    # This condition only fails for new panels. See gui.create().
-                    if child in child._parent.children:
-                        child._parent.children.remove(child)
-                        child._parent.request_layout()
-                    # Add child to new parent.
-                    assert pnl is not None, "Attempted to set parent to None."
-                    assert pnl is not child, "Attempted to make panel its own parent."
-                    child._parent = pnl
-                    pnl.children.insert(0, child)
-                    child.request_layout()
-            pnl.add_child_queue = []
-            for child in pnl.children:
-                add_children(child)
-
-        add_children(self.world)
+        # Tree changes are queued on the gui when requested and layout only
+        # visits dirty panels, so a frame without changes does no work.
+        if self.setup_queue:
+            self.process_setup_queue()
+        if self.delete_queue:
+            self.process_delete_queue()
+        if self.reparent_queue:
+            self.process_reparent_queue()
 
         if self.world.focus_request is not None:
             self.set_focus(self.world.focus_request)
@@ -258,18 +759,590 @@ class Gui:
 
         if self.world.layout_dirty:
             self.world.size = (window_width, window_height)
-            iterations = 0
-            while self.world.layout_dirty:
-                self.world.layout_dirty = False
-                self.world.process_move_queue()
-                self.world.layout(self.scheme, self.world.width, self.world.height)
-                iterations += 1
-                if iterations > 100:
-                    raise Exception("Maximum layout iterations reached.")
+            if self.move_queue:
+                self.process_move_queue()
+            self.world.arrange(self.scheme)
+
+    def process_setup_queue(self):
+        pending = self.setup_queue
+        self.setup_queue = dict()
+        for panel in pending:
+            if panel.marked_for_deletion or not panel.setup_dirty:
+                continue
+            hidden = self.hidden_ancestor(panel)
+            if hidden is not None:
+                # Hidden panels are set up once shown. They wait on the panel
+                # hiding them rather than in the queue, see Panel.visible.
+                if hidden.hidden_setups is None:
+                    hidden.hidden_setups = dict()
+                hidden.hidden_setups[panel] = None
+                continue
+            panel.setup(self.scheme, self)
+            panel.setup_dirty = False
+
+    def process_delete_queue(self):
+
+        def forget(pnl):
+            pnl.marked_for_deletion = True
+            self.new_panels.discard(pnl)
+            self.remove_global_listener(pnl)
+            if self.pointer_capture is pnl:
+                self.release_pointer()
+            for listeners in self.listeners.values():
+                listeners.pop(pnl, None)
+            self.broadcast_order.clear()
+            for scopes in self.accelerators.values():
+                scopes.pop(pnl, None)
+            for child in pnl.children:
+                forget(child)
+
+        pending = self.delete_queue
+        self.delete_queue = []
+        parents = dict()
+        for child in pending:
+            forget(child)
+            parent = child._parent
+            parents[parent] = None
+            parent.dirty_children.pop(child, None)
+            if child.composited_rect is not None:
+                parent.add_damage(child.composited_rect)
+            child.release_surface(self.surface_pool)
+            parent.request_layout()
+        # Each parent's children are filtered once, however many of them
+        # were removed.
+        for parent in parents:
+            children = [child for child in parent.children if not child.marked_for_deletion]
+            if len(children) != len(parent.children):
+                parent.invalidate_hit_index()
+            parent.children = children
+
+        # Events must not reach removed panels.
+        if self.focus is not None and self.focus.marked_for_deletion:
+            self.focus = None
+        for button, panel in self.press_panel.items():
+            if panel is not None and panel.marked_for_deletion:
+                self.press_panel[button] = None
+        for depth, panel in enumerate(self.hover_path):
+            if panel.marked_for_deletion:
+                self.hover_path = self.hover_path[:depth]
+                self.hover = self.hover_path[-1]
+                break
+        if any(panel.marked_for_deletion for panel in self.hit_path):
+            self.hit_path = []
+            self.hit_regions = []
+            self.hit_generation = None
+
+    def process_reparent_queue(self):
+        pending = self.reparent_queue
+        self.reparent_queue = []
+        for child, parent in pending:
+            # Removed before it could be added.
+            if child.marked_for_deletion or parent.marked_for_deletion:
+                continue
+            assert parent is not child, "Attempted to make panel its own parent."
+            if child in self.new_panels:
+                # New panels receive broadcasts of the events they handle.
+                self.new_panels.discard(child)
+                for event_name in child.handled_events:
+                    self.listeners[event_name][child] = None
+                    self.broadcast_order.pop(event_name, None)
+            else:
+                # Remove child from old parent.
+                old_parent = child._parent
+                old_parent.children.remove(child)
+                old_parent.dirty_children.pop(child, None)
+                old_parent.invalidate_hit_index()
+                if child.composited_rect is not None:
+                    old_parent.add_damage(child.composited_rect)
+                    child.composited_rect = None
+                old_parent.request_layout()
+            # Add child to new parent.
+            child._parent = parent
+            parent.children.insert(0, child)
+            parent.invalidate_hit_index()
+            parent.dirty_children[child] = None
+            parent.request_layout()
+            child.request_layout()
+
+    def process_move_queue(self):
+        pending = self.move_queue
+        self.move_queue = []
+        for child, index in pending:
+            parent = child._parent
+            # Child was removed or not added yet.
+            if child.marked_for_deletion or child not in parent.children:
+                continue
+            if index < 0:
+                index = len(parent.children) + index
+            # Child is already in place.
+            if parent.children[index] is child:
+                continue
+            # The child's area must be recomposited in its new z-order.
+            if child.composited_rect is not None:
+                parent.add_damage(child.composited_rect)
+            parent.children.remove(child)
+            parent.children.insert(index, child)
+            parent.child_reordered(child, index)
 
     def render(self, screen, clock):
-        self.world.surface = screen
-        self.world.render(self.scheme, screen, clock, self.world.width, self.world.height)
+        """
+        Render damaged regions of the gui onto the screen and return the list
+        of damaged screen rects, suitable for pygame.display.update(). Regions
+        outside the damage are left untouched so the screen must not be
+        cleared between frames.
+        """
+        if self.world.surface is not screen:
+            self.world.surface = screen
+            self.world.request_render()
+
+        if not self.world.render_dirty:
+            return []
+
+        self.surface_pool.display_format = self.scheme.display_format_surfaces
+        self.world.prepare_render(
+                pygame.Rect(0, 0, self.world.width, self.world.height),
+                [],
+                self.surface_pool)
+        damage = self.world.damage
+        if damage:
+            screen.set_clip(damage[0].unionall(damage[1:]))
+            screen.fill(self.background_color)
+            self.world.render(self.scheme, screen, clock, self.world.width, self.world.height)
+            screen.set_clip(None)
+            # Keep panel surfaces within budget.
+            self.surface_pool.evict()
+
+        self.world.render_dirty = False
+        self.world.damage = []
+        self.world.background_damage = []
+        return damage
+
+class GuiTest(unittest.TestCase):
+
+    class RecordingPanel(Panel):
+        def __init__(self, name, calls):
+            super().__init__()
+            self.name = name
+            self.calls = calls
+            self.accept_mouse_input = True
+            self.stop = False
+
+        def mouse_press_capture(self, event):
+            self.calls.append((self.name, event.phase, event.x, event.y))
+
+        def mouse_press(self, event):
+            self.calls.append((self.name, event.phase, event.x, event.y))
+            if self.stop:
+                event.stop_propagation()
+
+    def setUp(self):
+        self.gui = Gui()
+        self.gui.dispatch_mode = DispatchMode.TARGETED
+        self.calls = []
+        self.outer = self.gui.create(GuiTest.RecordingPanel, "outer", self.calls)
+        self.outer.rect = (10, 10, 100, 100)
+        self.inner = self.gui.create(GuiTest.RecordingPanel, "inner", self.calls)
+        self.inner.parent = self.outer
+        self.inner.rect = (10, 10, 50, 50)
+        self.other = self.gui.create(GuiTest.RecordingPanel, "other", self.calls)
+        self.other.rect = (200, 200, 10, 10)
+        self.gui.layout(640, 480)
+
+    def press(self, x, y):
+        self.gui.event(pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=(x, y), button=1))
+
+    def test_targeted(self):
+        self.press(25, 25)
+        self.assertEqual([
+            ("outer", EventPhase.CAPTURE, 15, 15),
+            ("inner", EventPhase.TARGET, 5, 5),
+            ("outer", EventPhase.BUBBLE, 15, 15)],
+            self.calls)
+
+    def test_stop_propagation(self):
+        self.inner.stop = True
+        self.press(25, 25)
+        self.assertEqual([
+            ("outer", EventPhase.CAPTURE, 15, 15),
+            ("inner", EventPhase.TARGET, 5, 5)],
+            self.calls)
+
+    def test_listeners(self):
+        self.assertEqual(frozenset(["mouse_press"]), GuiTest.RecordingPanel.handled_events)
+        self.assertIn(self.inner, self.gui.listeners["mouse_press"])
+        self.assertNotIn(self.gui.world, self.gui.listeners["mouse_press"])
+        self.assertNotIn(self.inner, self.gui.listeners["mouse_move"])
+
+        self.gui.dispatch_mode = DispatchMode.BROADCAST
+        self.other.visible = False
+        self.press(25, 25)
+        self.assertEqual(
+                [("inner", None, 5, 5), ("outer", None, 15, 15)],
+                sorted(self.calls))
+
+        self.outer.remove()
+        self.gui.layout(640, 480)
+        self.assertNotIn(self.inner, self.gui.listeners["mouse_press"])
+
+    def test_broadcast_order(self):
+        self.gui.dispatch_mode = DispatchMode.BROADCAST
+        self.outer.move_to_front()
+        self.gui.layout(640, 480)
+        self.press(25, 25)
+        self.assertEqual(["inner", "outer", "other"], [call[0] for call in self.calls])
+
+        self.calls.clear()
+        self.other.move_to_front()
+        self.gui.layout(640, 480)
+        self.press(25, 25)
+        self.assertEqual(["other", "inner", "outer"], [call[0] for call in self.calls])
+
+        # Moving panels and pressing the front panel keep the cached walk.
+        walk = self.gui.broadcast_order["mouse_press"]
+        self.calls.clear()
+        self.outer.x = 20
+        self.gui.layout(640, 480)
+        self.press(25, 25)
+        self.assertIs(walk, self.gui.broadcast_order["mouse_press"])
+        self.assertEqual(("outer", None, 5, 15), self.calls[2])
+
+    def test_enter_leave(self):
+        calls = []
+        for panel in (self.outer, self.inner, self.other):
+            panel.mouse_enter = lambda event, panel=panel: calls.append(("enter", panel.name, event.hover))
+            panel.mouse_leave = lambda event, panel=panel: calls.append(("leave", panel.name, event.hover))
+        move = lambda x, y: self.gui.event(pygame.event.Event(
+                pygame.MOUSEMOTION, pos=(x, y), rel=(0, 0), buttons=(0, 0, 0)))
+
+        move(25, 25)
+        self.assertEqual([("enter", "outer", False), ("enter", "inner", True)], calls)
+        calls.clear()
+        move(26, 26)
+        self.assertEqual([], calls)
+        move(15, 15)
+        self.assertEqual([("leave", "inner", False)], calls)
+        calls.clear()
+        move(205, 205)
+        self.assertEqual([("leave", "outer", False), ("enter", "other", True)], calls)
+
+    def test_coalesce_events(self):
+        Event = pygame.event.Event
+        pending = [
+            Event(pygame.MOUSEMOTION, pos=(1, 1), rel=(1, 1), buttons=(0, 0, 0)),
+            Event(pygame.MOUSEMOTION, pos=(4, 3), rel=(3, 2), buttons=(1, 0, 0)),
+            Event(pygame.MOUSEBUTTONDOWN, pos=(4, 3), button=5),
+            Event(pygame.MOUSEBUTTONUP, pos=(4, 3), button=5),
+            Event(pygame.MOUSEWHEEL, x=0, y=-1),
+            Event(pygame.MOUSEBUTTONDOWN, pos=(4, 3), button=5),
+            Event(pygame.MOUSEBUTTONUP, pos=(4, 3), button=5),
+            Event(pygame.MOUSEBUTTONDOWN, pos=(4, 3), button=1),
+            Event(pygame.MOUSEBUTTONUP, pos=(4, 3), button=1),
+            Event(pygame.MOUSEBUTTONDOWN, pos=(4, 3), button=1),
+            Event(pygame.MOUSEMOTION, pos=(5, 3), rel=(1, 0), buttons=(1, 0, 0))]
+        before = [(event.type, dict(event.dict)) for event in pending]
+        coalesce_events(pending)
+        events = coalesce_events(pending)
+        self.assertEqual([
+            (pygame.MOUSEMOTION, (4, 3), (4, 3)),
+            (pygame.MOUSEBUTTONDOWN, 5, 2),
+            (pygame.MOUSEBUTTONUP, 5, 1),
+            (pygame.MOUSEBUTTONDOWN, 1, 1),
+            (pygame.MOUSEBUTTONUP, 1, 1),
+            (pygame.MOUSEBUTTONDOWN, 1, 1),
+            (pygame.MOUSEMOTION, (5, 3), (1, 0))],
+            [(event.type, event.pos, event.rel) if event.type == pygame.MOUSEMOTION
+             else (event.type, event.button, getattr(event, "steps", 1))
+             for event in events])
+        # The caller's events are left untouched.
+        self.assertEqual(before, [(event.type, event.dict) for event in pending])
+
+    def test_global_listener(self):
+        self.gui.add_global_listener(self.other)
+        self.press(25, 25)
+        self.assertEqual(("other", EventPhase.GLOBAL, -175, -175), self.calls[-1])
+
+        self.other.remove()
+        self.gui.layout(640, 480)
+        self.assertNotIn(self.other, self.gui.global_listeners)
+
+    def test_focus_chain(self):
+        calls = []
+        for panel in (self.outer, self.inner, self.other):
+            panel.key_press = lambda event, panel=panel: calls.append((panel.name, event.phase))
+        key = lambda: self.gui.event(pygame.event.Event(
+                pygame.KEYDOWN, unicode="a", key=pygame.K_a, mod=0))
+
+        self.gui.dispatch_mode = DispatchMode.BROADCAST
+        self.gui.set_focus(self.inner)
+        key()
+        self.assertEqual([("inner", EventPhase.TARGET), ("outer", EventPhase.BUBBLE)], calls)
+
+        calls.clear()
+        self.inner.key_press = lambda event: event.stop_propagation()
+        self.gui.add_global_listener(self.other)
+        key()
+        self.assertEqual([], calls)
+
+        # Subscribed panels see every key once the chain is done.
+        self.gui.subscribe(self.other, "key_press")
+        key()
+        self.assertEqual([("other", EventPhase.GLOBAL)], calls)
+        calls.clear()
+        self.gui.set_focus(self.other)
+        key()
+        self.assertEqual([("other", EventPhase.TARGET)], calls)
+
+    def test_enum_values(self):
+        self.assertEqual(1, DispatchMode.BROADCAST.value)
+
+    def test_accelerators(self):
+        calls = []
+        self.inner.key_press = lambda event: calls.append("inner")
+        self.gui.add_accelerator(pygame.K_s, pygame.KMOD_LCTRL, lambda event: calls.append("global"))
+        self.gui.add_accelerator(pygame.K_s, pygame.KMOD_CTRL,
+                lambda event: calls.append("outer"), scope=self.outer)
+        key = lambda mod: self.gui.event(pygame.event.Event(
+                pygame.KEYDOWN, unicode="s", key=pygame.K_s, mod=mod))
+
+        self.gui.set_focus(self.inner)
+        key(pygame.KMOD_RCTRL | pygame.KMOD_CAPS)
+        self.gui.set_focus(self.other)
+        key(pygame.KMOD_LCTRL)
+        self.gui.set_focus(self.inner)
+        key(0)
+        self.assertEqual(["outer", "global", "inner"], calls)
+
+        self.outer.remove()
+        self.gui.layout(640, 480)
+        self.assertEqual([None], list(self.gui.accelerators[(pygame.K_s, pygame.KMOD_CTRL)]))
+
+    def test_incremental_hover(self):
+        self.gui.find_hover(25, 25)
+        self.assertIs(self.inner, self.gui.hover)
+        searched = []
+        for panel in (self.gui.world, self.outer, self.inner):
+            panel.children_at = (lambda x, y, panel=panel, children_at=panel.children_at:
+                    searched.append(panel.name) or children_at(x, y))
+        self.gui.world.name = "world"
+
+        self.gui.find_hover(30, 30)
+        self.assertEqual([], searched)
+
+        # Leaving the hover panel searches again from its parent.
+        self.gui.find_hover(80, 80)
+        self.assertIs(self.outer, self.gui.hover)
+        self.assertEqual(["outer"], searched)
+
+        # Changes to the tree search again from the world.
+        self.other.rect = (75, 75, 10, 10)
+        self.gui.find_hover(80, 80)
+        self.assertIs(self.other, self.gui.hover)
+        self.assertEqual(["outer", "world"], searched)
+
+    def test_incremental_hover_fallback(self):
+        box = self.gui.create(Panel)
+        box.rect = (300, 300, 100, 100)
+        a = self.gui.create(GuiTest.RecordingPanel, "a", self.calls)
+        a.parent = box
+        a.rect = (0, 0, 10, 10)
+        b = self.gui.create(GuiTest.RecordingPanel, "b", self.calls)
+        b.parent = box
+        b.rect = (50, 50, 10, 10)
+        self.gui.layout(640, 480)
+        self.gui.find_hover(305, 305)
+        self.assertIs(a, self.gui.hover)
+        self.gui.find_hover(330, 330)
+        self.assertIs(self.gui.world, self.gui.hover)
+        self.gui.find_hover(355, 355)
+        self.assertIs(b, self.gui.hover)
+
+    def test_event_pool(self):
+        events = []
+        self.inner.mouse_press = lambda event: events.append(event)
+        self.press(25, 25)
+        self.press(30, 30)
+        self.assertIs(events[0], events[1])
+        self.assertEqual((30, 30), (events[1].x, events[1].y))
+        with self.assertRaises(AttributeError):
+            events[0].name = "press"
+
+        copy_event = copy.copy(events[0])
+        self.press(35, 35)
+        self.assertEqual((30, 30), (copy_event.x, copy_event.y))
+
+    def test_incremental_layout(self):
+        laid_out = []
+        for panel in (self.outer, self.inner, self.other):
+            panel.layout = (lambda scheme, w, h, panel=panel, layout=panel.layout:
+                    laid_out.append(panel.name) or layout(scheme, w, h))
+        self.gui.layout(640, 480)
+        self.assertEqual([], laid_out)
+
+        self.inner.request_layout()
+        self.gui.layout(640, 480)
+        self.assertEqual(["outer", "inner"], laid_out)
+
+        self.inner.remove()
+        self.assertEqual([self.inner], self.gui.delete_queue)
+        self.gui.layout(640, 480)
+        self.assertEqual([], self.outer.children)
+        self.assertEqual([], self.gui.delete_queue)
+
+    def test_size_to_content(self):
+        from desky.context_menu import ContextMenuPanel
+        self.gui.scheme = DebugScheme()
+        menu = self.gui.create(ContextMenuPanel)
+        menu.width = 120
+        items = [self.gui.create(Panel) for _ in range(3)]
+        for item in items:
+            item.height = 20
+            menu.add(item)
+        laid_out = []
+        menu.layout = (lambda scheme, w, h, layout=menu.layout:
+                laid_out.append(menu) or layout(scheme, w, h))
+        self.gui.layout(640, 480)
+        self.assertEqual((120, 60), menu.size)
+        self.assertEqual(Panel.Rect(0, 40, 120, 20), items[2].rect)
+        self.assertEqual(1, len(laid_out))
+
+        items[0].height = 30
+        self.gui.layout(640, 480)
+        self.assertEqual((120, 70), menu.size)
+        self.assertEqual(Panel.Rect(0, 50, 120, 20), items[2].rect)
+        self.assertEqual(2, len(laid_out))
+
+    def test_hidden_setup(self):
+        setups = []
+        self.inner.setup = lambda scheme, gui: setups.append("inner")
+        self.outer.visible = False
+        self.inner.request_setup()
+        self.gui.layout(640, 480)
+        self.assertEqual([], setups)
+        self.assertEqual({}, self.gui.setup_queue)
+        self.assertIn(self.inner, self.outer.hidden_setups)
+
+        self.outer.visible = True
+        self.gui.layout(640, 480)
+        self.assertEqual(["inner"], setups)
+        self.assertIsNone(self.outer.hidden_setups)
+
+    def test_remove_focus_and_hover(self):
+        calls = []
+        self.inner.key_press = lambda event: calls.append("key")
+        self.inner.mouse_leave = lambda event: calls.append("leave")
+        self.gui.event(pygame.event.Event(pygame.MOUSEMOTION, pos=(25, 25), rel=(0, 0)))
+        self.gui.set_focus(self.inner)
+        self.assertIs(self.inner, self.gui.hover)
+
+        self.outer.remove()
+        self.gui.layout(640, 480)
+        self.assertIsNone(self.gui.focus)
+        self.assertIs(self.gui.world, self.gui.hover)
+        self.assertEqual([self.gui.world], self.gui.hover_path)
+        self.assertEqual([], self.gui.hit_path)
+
+        self.gui.event(pygame.event.Event(pygame.KEYDOWN, unicode="a", key=pygame.K_a, mod=0))
+        self.gui.event(pygame.event.Event(pygame.MOUSEMOTION, pos=(205, 205), rel=(0, 0)))
+        self.assertEqual([], calls)
+        self.assertIs(self.other, self.gui.hover)
+
+        # Panels never added to a gui can be removed too.
+        Panel().remove()
+
+    def test_batch(self):
+        with self.gui.batch():
+            self.inner.rect = (5, 5, 40, 40)
+            self.inner.margins = (1, 1, 1, 1)
+            self.assertFalse(self.inner.layout_dirty)
+            self.assertFalse(self.gui.world.layout_dirty)
+        self.assertEqual([self.inner], list(self.outer.dirty_children))
+        self.assertTrue(self.outer.layout_dirty)
+        self.assertTrue(self.gui.world.layout_dirty)
+        self.assertTrue(self.gui.world.render_dirty)
+
+    def test_capture_pointer(self):
+        moves = []
+        self.other.mouse_drag = lambda event: moves.append((event.x, event.y))
+        self.inner.mouse_move = lambda event: moves.append("inner")
+        self.gui.capture_pointer(self.other)
+        self.gui.event(pygame.event.Event(pygame.MOUSEMOTION, pos=(25, 25), rel=(1, 1)))
+        self.assertEqual([(-175, -175)], moves)
+        self.assertIs(self.gui.world, self.gui.hover)
+
+        self.other.mouse_release = lambda event: self.gui.release_pointer()
+        self.gui.event(pygame.event.Event(pygame.MOUSEBUTTONUP, pos=(25, 25), button=1))
+        self.assertIsNone(self.gui.pointer_capture)
+        self.assertIs(self.inner, self.gui.hover)
+
+    def test_capture_wheel(self):
+        from desky.adjustable_divider import AdjustableDividerGrabber
+        pygame.freetype.init()
+        grabber = self.gui.create(AdjustableDividerGrabber)
+        grabber.rect = (300, 300, 8, 40)
+        adjustments = []
+        grabber.adjust = lambda dx, dy, final: adjustments.append((dx, dy, final))
+        self.gui.layout(640, 480)
+        self.assertNotIn(grabber, self.gui.listeners["mouse_move"])
+
+        button = lambda kind, x, y, number: self.gui.event(
+                pygame.event.Event(kind, pos=(x, y), button=number))
+        button(pygame.MOUSEBUTTONDOWN, 302, 310, 1)
+        self.gui.event(pygame.event.Event(pygame.MOUSEMOTION, pos=(312, 310), rel=(10, 0)))
+        # Wheel steps arrive as presses and releases of buttons 4 and 5.
+        button(pygame.MOUSEBUTTONDOWN, 312, 310, 4)
+        button(pygame.MOUSEBUTTONUP, 312, 310, 4)
+        self.assertIs(grabber, self.gui.pointer_capture)
+        button(pygame.MOUSEBUTTONUP, 315, 310, 1)
+        self.assertIsNone(self.gui.pointer_capture)
+        self.assertEqual([(10, 0, False), (13, 0, True)], adjustments)
+
+    def test_capture_buttons(self):
+        from desky.adjustable_divider import AdjustableDividerGrabber
+        from desky.text_entry import TextEntry
+        pygame.freetype.init()
+        grabber = self.gui.create(AdjustableDividerGrabber)
+        grabber.rect = (300, 300, 8, 40)
+        adjustments = []
+        grabber.adjust = lambda dx, dy, final: adjustments.append((dx, dy, final))
+        entry = self.gui.create(TextEntry)
+        entry.rect = (400, 300, 100, 30)
+        entry.text = "text"
+        self.gui.layout(640, 480)
+
+        # Only the left button grabs the divider or selects text.
+        for x, y in ((302, 310), (410, 310)):
+            for number in (3, 4):
+                self.gui.event(pygame.event.Event(
+                        pygame.MOUSEBUTTONDOWN, pos=(x, y), button=number))
+                self.assertIsNone(self.gui.pointer_capture)
+                self.gui.event(pygame.event.Event(
+                        pygame.MOUSEMOTION, pos=(x + 10, y), rel=(10, 0)))
+                self.gui.event(pygame.event.Event(
+                        pygame.MOUSEBUTTONUP, pos=(x + 10, y), button=number))
+        self.assertEqual([], adjustments)
+        self.assertFalse(entry.selecting)
+        self.assertIsNone(grabber.grab_point)
+
+    def test_wheel_checkbox(self):
+        from desky.button import ButtonState
+        from desky.checkbox import Checkbox
+        pygame.freetype.init()
+        checkbox = self.gui.create(Checkbox)
+        checkbox.rect = (300, 300, 100, 30)
+        self.gui.layout(640, 480)
+
+        # Merged wheel steps neither toggle the checkbox nor press it.
+        steps = [pygame.event.Event(kind, pos=(310, 310), button=5)
+                 for _ in range(2)
+                 for kind in (pygame.MOUSEBUTTONDOWN, pygame.MOUSEBUTTONUP)]
+        self.gui.events(steps)
+        self.assertFalse(checkbox.on)
+        self.assertEqual(ButtonState.HOVER, checkbox.state)
+
+        self.gui.events([
+                pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=(310, 310), button=1),
+                pygame.event.Event(pygame.MOUSEBUTTONUP, pos=(310, 310), button=1)])
+        self.assertTrue(checkbox.on)
 
 def example(setup):
     pygame.init()
@@ -285,17 +1358,17 @@ def example(setup):
 
     running = True
     while running:
+        events = []
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
             elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
                 running = False
             else:
-                gui.event(event)
-        screen.fill((30, 30, 30))
+                events.append(event)
+        gui.events(events)
         gui.layout(screen.get_width(), screen.get_height())
-        gui.render(screen, clock)
-        pygame.display.flip()
+        pygame.display.update(gui.render(screen, clock))
         clock.tick()
 
 def input_example(gui):
@@ -13,6 +13,10 @@ class DockLayout:
 
     def __init__(self):
         self.panels = list()
+        # Constraints each docked panel was measured with by the last layout,
+        # None for panels whose desired size is not used.
+        self.constraints = list()
+        self.last_fingerprint = None
 
     def dock_top(self, panel):
         self.panels.append((panel, self.TOP))
@@ -29,31 +33,75 @@ class DockLayout:
     def dock_fill(self, panel):
         self.panels.append((panel, self.FILL))
 
+    def measure(self, panel, w=None, h=None):
+        """
+        Return the size panel needs to fit the docked panels at their desired
+        sizes when given at most w by h.
+        """
+        padding = panel.padding
+        if w is not None:
+            w -= padding.x + padding.w
+        if h is not None:
+            h -= padding.y + padding.h
+        # Panels docked later fill the area left by the earlier ones.
+        width, height = 0, 0
+        for child, side in reversed(self.panels):
+            child_w, child_h = child.desired_outer_size(w, h)
+            if side in (self.TOP, self.BOTTOM):
+                width = max(width, child_w)
+                height += child_h
+            elif side in (self.LEFT, self.RIGHT):
+                width += child_w
+                height = max(height, child_h)
+            elif side == self.FILL:
+                width = max(width, child_w)
+                height = max(height, child_h)
+        return (width + padding.x + padding.w, height + padding.y + padding.h)
+
+    def fingerprint(self, panel):
+        # As for GridLayout.fingerprint(): the panel's inner area and the
+        # docked panels with their rects, margins and desired sizes.
+        return (
+                panel.width,
+                panel.height,
+                panel.padding.as_tuple(),
+                tuple((child, side, child.rect.as_tuple(), child.margins.as_tuple(),
+                        None if constraint is None else child.desired_outer_size(*constraint))
+                    for (child, side), constraint in zip(self.panels, self.constraints)))
+
     def layout(self, panel):
+        if (len(self.constraints) == len(self.panels)
+                and self.fingerprint(panel) == self.last_fingerprint):
+            return
+
         area = panel.rect_inner.move(-panel.x, -panel.y)
+        self.constraints = list()
         for item in self.panels:
             child = item[0]
             side = item[1]
+            self.constraints.append(None if side == self.FILL else (area.w, area.h))
 
             if side == self.TOP:
-                outer_h = child.rect_outer.h
+                outer_h = child.desired_outer_size(area.w, area.h)[1]
                 child.rect_outer = Panel.Rect(area.x, area.y, area.w, outer_h)
                 area.shrink(0, outer_h, 0, 0)
             elif side == self.BOTTOM:
-                outer_h = child.rect_outer.h
+                outer_h = child.desired_outer_size(area.w, area.h)[1]
                 child.rect_outer = Panel.Rect(area.x, area.bottom - outer_h, area.w, outer_h)
                 area.shrink(0, 0, 0, outer_h)
             elif side == self.LEFT:
-                outer_w = child.rect_outer.w
+                outer_w = child.desired_outer_size(area.w, area.h)[0]
                 child.rect_outer = Panel.Rect(area.x, area.y, outer_w, area.h)
                 area.shrink(outer_w, 0, 0, 0)
             elif side == self.RIGHT:
-                outer_w = child.rect_outer.w
+                outer_w = child.desired_outer_size(area.w, area.h)[0]
                 child.rect_outer = Panel.Rect(area.right - outer_w, area.y, outer_w, area.h)
                 area.shrink(0, 0, outer_w, 0)
             elif side == self.FILL:
                 child.rect_outer = Panel.Rect(area.x, area.y, area.w, area.h)
 
+        self.last_fingerprint = self.fingerprint(panel)
+
 class DockLayoutTest(unittest.TestCase):
 
     def setUp(self):
@@ -139,6 +187,56 @@ class DockLayoutTest(unittest.TestCase):
         self.assertFalse(self.parent.layout_dirty)
         self.assertFalse(self.gui.world.layout_dirty)
 
+    def test_memoized(self):
+        class CountingPanel(Panel):
+            writes = 0
+            @Panel.rect_outer.setter
+            def rect_outer(self, rect):
+                CountingPanel.writes += 1
+                Panel.rect_outer.fset(self, rect)
+
+        child = self.gui.create(CountingPanel)
+        child.parent = self.parent
+        child.size = (33, 44)
+        self.layout.dock_top(child)
+        self.layout.layout(self.parent)
+        self.layout.layout(self.parent)
+        self.assertEqual(1, CountingPanel.writes)
+
+        child.height = 50
+        self.layout.layout(self.parent)
+        self.assertEqual(2, CountingPanel.writes)
+        self.parent.width = 300
+        self.layout.layout(self.parent)
+        self.assertEqual(3, CountingPanel.writes)
+        self.assertEqual(Panel.Rect(2, 3, 294, 50), child.rect)
+
+    def test_child_resized_in_layout(self):
+        dock = self.layout
+        class DockPanel(Panel):
+            def layout(self, scheme, w, h):
+                dock.layout(self)
+                self.layout_children(scheme, w, h)
+        class GrowingPanel(Panel):
+            def layout(self, scheme, w, h):
+                self.height = 50
+
+        parent = self.gui.create(DockPanel)
+        parent.size = (100, 200)
+        top = self.gui.create(GrowingPanel)
+        top.parent = parent
+        top.height = 30
+        dock.dock_top(top)
+        fill = self.gui.create(Panel)
+        fill.parent = parent
+        dock.dock_fill(fill)
+        self.gui.layout(1000, 1000)
+
+        # The docked panels are placed again once the top one has grown.
+        self.assertEqual(Panel.Rect(0, 0, 100, 50), top.rect)
+        self.assertEqual(Panel.Rect(0, 50, 100, 150), fill.rect)
+        self.assertFalse(parent.layout_dirty)
+
 def dock_example(gui):
     panel = gui.create(Panel)
     panel.rect = (50, 50, 500, 500)
@@ -44,6 +44,7 @@ class GridLayout:
         self.column_count = column_count
         self.row_count = row_count
         self.spacing = spacing
+        self.last_fingerprint = None
 
     def add(self, panel, column, row, column_count=1, row_count=1):
         self.add_rect(panel, Rect(column, row, column_count, row_count))
@@ -117,7 +118,7 @@ class GridLayout:
             rect, panel = rect_panel_tuple
             # In case a panel spans multiple columns, determine the height as a
             # proportional amount.
-            return int((panel.rect_outer.w - (rect.w - 1) * self.spacing) / rect.w)
+            return int((panel.desired_outer_size()[0] - (rect.w - 1) * self.spacing) / rect.w)
         return reduce(max, map(calculate_width, rect_panel_tuples_that_intersect_column), 0)
 
     def tallest_child_in_row(self, row):
@@ -130,11 +131,36 @@ class GridLayout:
             rect, panel = rect_panel_tuple
             # In case a panel spans multiple rows, determine the height as a
             # proportional amount.
-            return int((panel.rect_outer.h - (rect.h - 1) * self.spacing) / rect.h)
+            return int((panel.desired_outer_size()[1] - (rect.h - 1) * self.spacing) / rect.h)
         return reduce(max, map(calculate_height, rect_panel_tuples_that_intersect_row), 0)
 
+    def fingerprint(self, panel):
+        # Everything layout depends on, layout() computes and writes nothing
+        # while it is unchanged. Custom sizing functions are compared by
+        # identity so their results must only depend on their arguments.
+        sizings = (tuple(self.column_sizings.values()) + tuple(self.row_sizings.values()))
+        if any(sizing[0] == self.CHILD for sizing in sizings):
+            child_sizes = tuple(child.desired_outer_size() for child in self.panels.values())
+        else:
+            child_sizes = None
+        return (
+                panel.width,
+                panel.height,
+                panel.padding.as_tuple(),
+                self.column_count,
+                self.row_count,
+                self.spacing,
+                tuple(self.column_sizings.items()),
+                tuple(self.row_sizings.items()),
+                tuple((rect, child, child.rect.as_tuple(), child.margins.as_tuple())
+                    for rect, child in self.panels.items()),
+                child_sizes)
+
     def layout(self, panel):
 
+        if self.fingerprint(panel) == self.last_fingerprint:
+            return
+
         area = (panel.rect_inner
                 .move(-panel.x, -panel.y)
                 .shrink(
@@ -257,12 +283,14 @@ class GridLayout:
 
         # Position child panels.
 
-        for rect, panel in self.panels.items():
+        for rect, child in self.panels.items():
             x = area.x + sum(column_widths[:rect.x]) + rect.x * self.spacing
             y = area.y + sum(row_heights[:rect.y]) + rect.y * self.spacing
             width = sum(column_widths[rect.x:rect.right]) + (rect.w - 1) * self.spacing
             height = sum(row_heights[rect.y:rect.bottom]) + (rect.h - 1) * self.spacing
-            panel.rect_outer = Panel.Rect(x, y, width, height)
+            child.rect_outer = Panel.Rect(x, y, width, height)
+
+        self.last_fingerprint = self.fingerprint(panel)
 
 class GridLayoutTest(unittest.TestCase):
 
@@ -713,6 +741,34 @@ class GridLayoutTest(unittest.TestCase):
         self.assertEqual(Panel.Rect(7 + width_0, 3,            width_1, height_0), child_1_0.rect_outer)
         self.assertEqual(Panel.Rect(7 + width_0, 8 + height_0, width_1, height_1), child_1_1.rect_outer)
 
+    def test_memoized(self):
+        grid = GridLayout(column_count=2, row_count=1)
+        grid.set_child_column_sizing(0)
+        grid.set_fill_column_sizing(1)
+        grid.set_fill_row_sizing(0)
+
+        child_0 = self.gui.create(Panel)
+        child_0.parent = self.parent
+        child_0.size = (40, 20)
+        grid.add(child_0, 0, 0)
+        child_1 = self.gui.create(Panel)
+        child_1.parent = self.parent
+        grid.add(child_1, 1, 0)
+
+        grid.layout(self.parent)
+        self.assertEqual(Panel.Rect(42, 3, 154, 292), child_1.rect)
+        fingerprint = grid.last_fingerprint
+        grid.layout(self.parent)
+        self.assertIs(fingerprint, grid.last_fingerprint)
+
+        child_0.width = 60
+        grid.layout(self.parent)
+        self.assertEqual(Panel.Rect(62, 3, 134, 292), child_1.rect)
+
+        grid.set_fixed_column_sizing(0, 100)
+        grid.layout(self.parent)
+        self.assertEqual(Panel.Rect(102, 3, 94, 292), child_1.rect)
+
 def grid_example(gui):
     panel = gui.create(Panel)
     panel.rect = (50, 50, 500, 500)
@@ -4,6 +4,7 @@ import unittest
 import pygame
 
 from desky.rect import Rect, RectTest
+from desky.spatial_index import SpatialIndex
 
 class LayoutOnChange:
     def __init__(self, private_name, default):
@@ -31,6 +32,25 @@ class RenderOnChange:
             setattr(obj, self.private_name, default)
             obj.request_render()
 
+def merge_damage(damage, rect):
+    # Skip regions already covered by pending damage and drop pending damage
+    # covered by the new region.
+    if any(damaged.contains(rect) for damaged in damage):
+        return damage
+    damage = [damaged for damaged in damage if not rect.contains(damaged)]
+    damage.append(rect)
+    return damage
+
+def clip_damage(damage, visible, occluders):
+    # Drop damage that can not be seen.
+    clipped = []
+    for damaged in damage:
+        damaged = damaged.clip(visible)
+        if (damaged.w > 0 and damaged.h > 0
+                and not any(occluder.contains(damaged) for occluder in occluders)):
+            clipped.append(damaged)
+    return clipped
+
 def add_layout_attribute(cls, name, default):
     private_name = "_" + name
     setattr(cls, private_name, default)
@@ -53,8 +73,39 @@ def render_attribute(name, default):
         return cls
     return dec
 
+# Event handlers the Gui dispatches to panels.
+event_handlers = (
+    "mouse_move",
+    "mouse_press",
+    "mouse_release",
+    "mouse_click",
+    "key_press",
+    "key_release"
+)
+
 class Panel:
 
+    # Names of the mouse event handlers overridden by this class. Broadcasts
+    # only reach panels overriding the handler or subscribed with
+    # Gui.subscribe(). Key events follow the focus chain, so overriding a key
+    # handler does not subscribe to every key.
+    handled_events = frozenset()
+
+    # Incremented whenever hit testing may give a different result: a panel
+    # moved, resized, was shown or hidden, changed accept_mouse_input, or
+    # children were added, removed or reordered. See Gui.find_hover.
+    hit_generation = 0
+
+    # Incremented whenever children are added, removed or reordered.
+    tree_generation = 0
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.handled_events = frozenset(
+                name for name in event_handlers
+                if name.startswith("mouse_")
+                and getattr(cls, name) is not getattr(Panel, name))
+
     class Rect(Rect):
         """
         Panel.Rect extends Rect to add layout requests on change. This makes it
@@ -72,33 +123,47 @@ class Panel:
             if self._x == x:
                 return
             self._x = x
-            if self.panel:
-                self.panel.request_layout()
+            self.request_move()
 
         @Rect.y.setter
         def y(self, y):
             if self._y == y:
                 return
             self._y = y
-            if self.panel:
-                self.panel.request_layout()
+            self.request_move()
 
         @Rect.w.setter
         def w(self, w):
             if self._w == w:
                 return
             self._w = w
-            if self.panel:
-                self.panel.request_layout()
+            self.request_resize()
 
         @Rect.h.setter
         def h(self, h):
             if self._h == h:
                 return
             self._h = h
-            if self.panel:
+            self.request_resize()
+
+        def request_move(self):
+            if not self.panel:
+                return
+            # Moving the panel's own rect leaves its contents unchanged, but
+            # moving its margins or padding changes its layout.
+            if self is self.panel._rect:
+                self.panel.rect_changed()
+                self.panel.request_move()
+            else:
                 self.panel.request_layout()
 
+        def request_resize(self):
+            if not self.panel:
+                return
+            if self is self.panel._rect:
+                self.panel.rect_changed()
+            self.panel.request_layout()
+
         def copy(self):
             return Panel.Rect(self.x, self.y, self.w, self.h)
 
@@ -109,44 +174,115 @@ class Panel:
         self._margins = Panel.Rect(0, 0, 0, 0, self)
         self._padding = Panel.Rect(0, 0, 0, 0, self)
         self.setup_dirty = True
+        # Setups of this panel and its descendants put off while this panel
+        # is hidden, see Gui.process_setup_queue().
+        self.hidden_setups = None
         self.layout_dirty = True
+        # Children with layout_dirty set, in the order they requested layout.
+        self.dirty_children = dict()
+        # Set while the panel is arranged, see arrange(). Layout requests of
+        # its children stop here instead of laying out the ancestors again.
+        self.arranging = False
+        self.children_dirtied = False
+        # Desired sizes by (w, h) constraint, see desired_size().
+        self.measure_cache = None
+        # Set on panels sized by their desired size rather than by their
+        # parent's layout. The parent applies it before arranging the panel.
+        self.size_to_content = False
         self.render_dirty = True
+        self._visible = True
         self.surface = None
-        self.accept_mouse_input = False
+        # Set on panels whose layout depends on the positions of their
+        # children so that moving a child lays the panel out again.
+        self.layout_on_child_move = False
+        # Panels with children cache their own drawing separately so that
+        # child changes are composited without calling into the scheme.
+        self.background = None
+        self.rendering_background = False
+        # Set when the surfaces were evicted to stay within the surface
+        # budget. The pixels remain composited in the parent.
+        self.surface_evicted = False
+        # Opaque panels cover their entire rect with opaque pixels, which lets
+        # the compositor skip anything underneath them. Usually set by the
+        # scheme during setup.
+        self.opaque = False
+        # Region of the surface, in local coordinates, holding up to date
+        # pixels.
+        self.render_area = pygame.Rect(0, 0, 0, 0)
+        # Rects, in local coordinates, hidden by opaque panels above this one
+        # when it was last rendered.
+        self.occluders = []
+        # Regions of this panel, in local coordinates, that must be
+        # recomposited on the next render.
+        self.damage = []
+        # Regions of the panel's own drawing, in local coordinates, that must
+        # be redrawn by the scheme on the next render.
+        self.background_damage = []
+        # Rect in parent coordinates where this panel was last composited.
+        self.composited_rect = None
+        self._accept_mouse_input = False
+        # Spatial index of the children for hit testing, built on demand.
+        self.hit_index = None
         self.focus_request = None
         self.parent_panel = None
-        # Children-modifying operations are not safe to perform during events,
-        # layout, render, etc. since those events iterate over the children.
-        self.move_queue = []
-        self.add_child_queue = []
+        # Gui the panel was created by, see Gui.create(). Children-modifying
+        # operations are not safe to perform during events, layout, render,
+        # etc. since those events iterate over the children, so they are
+        # queued on the gui and applied by Gui.layout().
+        self.gui = None
         self.marked_for_deletion = False
 
+    def in_place(self, index):
+        # Whether the panel is at index in its parent's children with no moves
+        # pending that could change that.
+        return not self.gui.move_queue and self._parent.children[index:][:1] == [self]
+
     def move_to_front(self):
-        if self._parent is None:
+        if self._parent is None or self.in_place(0):
             return
-        self._parent.move_queue.append((self, 0))
+        self.gui.move_queue.append((self, 0))
         self.parent.request_layout()
 
     def move_to_back(self):
-        if self._parent is None:
+        if self._parent is None or self.in_place(-1):
             return
-        self._parent.move_queue.append((self, -1))
+        self.gui.move_queue.append((self, -1))
         self.parent.request_layout()
 
-    def process_move_queue(self):
-        if len(self.move_queue) == 0:
+    @property
+    def visible(self):
+        return self._visible
+
+    @visible.setter
+    def visible(self, visible):
+        # Hidden panels are skipped by setup, layout, render, hit testing and
+        # events but keep their state, so showing them again is cheap.
+        if self._visible == visible:
+            return
+        self._visible = visible
+        Panel.hit_generation += 1
+        if visible and self.hidden_setups is not None:
+            self.gui.setup_queue.update(self.hidden_setups)
+            self.hidden_setups = None
+        if self.parent is None:
             return
+        if visible and self.layout_dirty:
+            # Layout requests made while hidden stopped at this panel.
+            self.parent.dirty_children[self] = None
+            self.parent.request_layout()
+        else:
+            self.parent.request_composite()
 
-        for child, index in self.move_queue:
-            # Child was removed after move was queued.
-            if not child in self.children:
-                return
-            self.children.remove(child)
-            if index < 0:
-                index = len(self.children) + index + 1
-            self.children.insert(index, child)
+    @property
+    def accept_mouse_input(self):
+        return self._accept_mouse_input
 
-        self.move_queue = []
+    @accept_mouse_input.setter
+    def accept_mouse_input(self, accept_mouse_input):
+        if self._accept_mouse_input == accept_mouse_input:
+            return
+        self._accept_mouse_input = accept_mouse_input
+        Panel.hit_generation += 1
 
     @property
     def rect(self):
@@ -300,7 +436,7 @@ class Panel:
             return
         while parent.parent_panel is not None:
             parent = parent.parent_panel
-        parent.add_child_queue.append(self)
+        self.gui.reparent_queue.append((self, parent))
         parent.request_layout()
 
     def request_setup(self):
@@ -309,22 +445,122 @@ class Panel:
         if self.setup_dirty:
             return
         self.setup_dirty = True
+        if self.gui is not None:
+            self.gui.setup_queue[self] = None
 
     def request_layout(self):
-        if not self.render_dirty:
-            self.request_render()
+        # Desired sizes of the panel and its ancestors may depend on it.
+        panel = self
+        while panel is not None and panel.measure_cache is not None:
+            panel.measure_cache = None
+            panel = panel.parent
+        if self.gui is not None and self.gui.batch_depth > 0:
+            self.gui.batched_layout[self] = None
+            return
+        # Layout only changes pixels through size and position changes, which
+        # are picked up as damage when the panel is composited.
+        self.request_composite()
         if self.layout_dirty:
             return
         self.layout_dirty = True
         if self.parent:
+            self.parent.dirty_children[self] = None
+            if self.parent.arranging:
+                # The parent visits its dirty children before it is done.
+                self.parent.children_dirtied = True
+            else:
+                self.parent.request_layout()
+
+    def rect_changed(self):
+        Panel.hit_generation += 1
+        if self._parent is not None and self._parent.hit_index is not None:
+            self._parent.hit_index.invalidate(self)
+
+    def invalidate_hit_index(self):
+        # Called when children are added or removed.
+        Panel.hit_generation += 1
+        Panel.tree_generation += 1
+        self.hit_index = None
+
+    def child_reordered(self, child, index):
+        # Called when a child moved to index in the z-order. Moves to the
+        # front or back are applied to the hit index rather than rebuilding it.
+        Panel.hit_generation += 1
+        Panel.tree_generation += 1
+        if self.hit_index is None:
+            return
+        if index == 0:
+            self.hit_index.move_to_front(child)
+        elif index == len(self.children) - 1:
+            self.hit_index.move_to_back(child)
+        else:
+            self.hit_index = None
+
+    def children_at(self, x, y):
+        # Visible children containing the local point, top first.
+        if len(self.children) < SpatialIndex.min_children:
+            return [child for child in self.children
+                    if child.visible and child.rect.contains_point(x, y)]
+        if self.hit_index is None:
+            self.hit_index = SpatialIndex(self.children)
+        return [child for child in self.hit_index.query(x, y) if child.visible]
+
+    def children_overlapping(self, rect):
+        # Visible children intersecting the local rect, top first.
+        if len(self.children) < SpatialIndex.min_children:
+            return [child for child in self.children
+                    if child.visible and child.rect.intersects(rect)]
+        if self.hit_index is None:
+            self.hit_index = SpatialIndex(self.children)
+        return [child for child in self.hit_index.overlapping(rect) if child.visible]
+
+    def hit_cell(self, x, y):
+        # Local (x, y, w, h) spatial index cell containing the point, None when
+        # the children are hit tested linearly.
+        if len(self.children) < SpatialIndex.min_children:
+            return None
+        if self.hit_index is None:
+            self.hit_index = SpatialIndex(self.children)
+        return self.hit_index.cell_rect(x, y)
+
+    def request_move(self):
+        # A move only changes where the panel is composited in its parent, so
+        # neither the panel's layout nor its pixels are invalidated.
+        if self.parent is None:
+            return
+        if self.parent.layout_on_child_move:
             self.parent.request_layout()
+        else:
+            self.parent.request_composite()
+
+    def request_render(self, rect=None):
+        # Invalidate the whole panel or only a local region of it. Schemes
+        # can get the region being redrawn from surface.get_clip().
+        bounds = pygame.Rect(0, 0, self.width, self.height)
+        if rect is not None:
+            bounds = bounds.clip(pygame.Rect(rect))
+            if bounds.w <= 0 or bounds.h <= 0:
+                return
+        self.add_render_damage(bounds)
 
-    def request_render(self):
+    def request_composite(self):
         if self.render_dirty:
             return
+        if self.gui is not None and self.gui.batch_depth > 0:
+            self.gui.batched_composite[self] = None
+            return
         self.render_dirty = True
         if self.parent:
-            self.parent.request_render()
+            self.parent.request_composite()
+
+    def add_damage(self, rect):
+        self.damage = merge_damage(self.damage, rect)
+        self.request_composite()
+
+    def add_render_damage(self, rect):
+        # Damage that also invalidates the panel's own drawing.
+        self.background_damage = merge_damage(self.background_damage, rect)
+        self.add_damage(rect)
 
     def request_focus(self, panel=None):
         if panel is None:
@@ -339,6 +575,8 @@ class Panel:
             return
         self.marked_for_deletion = True
         self.request_layout()
+        if self.gui is not None:
+            self.gui.delete_queue.append(self)
 
     @property
     def removed(self):
@@ -356,12 +594,44 @@ class Panel:
     def mouse_click(self, event):
         pass
 
+    def mouse_enter(self, event):
+        pass
+
+    def mouse_leave(self, event):
+        pass
+
     def key_press(self, event):
         pass
 
     def key_release(self, event):
         pass
 
+    def mouse_drag(self, event):
+        # Receives the mouse motion events instead of mouse_move while the
+        # panel holds the pointer, see Gui.capture_pointer(). Not broadcast.
+        pass
+
+    # Capture phase handlers, called on the ancestors of the target before
+    # the target itself under targeted dispatch.
+
+    def mouse_move_capture(self, event):
+        pass
+
+    def mouse_press_capture(self, event):
+        pass
+
+    def mouse_release_capture(self, event):
+        pass
+
+    def mouse_click_capture(self, event):
+        pass
+
+    def key_press_capture(self, event):
+        pass
+
+    def key_release_capture(self, event):
+        pass
+
     def focus_change(self, focus):
         pass
 
@@ -371,40 +641,287 @@ class Panel:
     def layout(self, scheme, w, h):
         scheme.layout_panel(self, w, h)
 
+    def measure(self, scheme, w, h):
+        """
+        Return the (width, height) the panel would like to have when given at
+        most w by h, either of which may be None when unconstrained.
+        Subclasses whose size depends on their content override this.
+        """
+        return scheme.measure_panel(self, w, h)
+
+    def desired_size(self, w=None, h=None):
+        # Measured bottom-up and cached until the panel or a descendant
+        # requests layout.
+        if self.gui is None:
+            return (self.width, self.height)
+        if self.measure_cache is None:
+            self.measure_cache = dict()
+        size = self.measure_cache.get((w, h))
+        if size is None:
+            size = self.measure(self.gui.scheme, w, h)
+            self.measure_cache[(w, h)] = size
+        return size
+
+    def desired_outer_size(self, w=None, h=None):
+        margins = self.margins
+        if w is not None:
+            w -= margins.x + margins.w
+        if h is not None:
+            h -= margins.y + margins.h
+        width, height = self.desired_size(w, h)
+        return (width + margins.x + margins.w, height + margins.y + margins.h)
+
+    def arrange(self, scheme):
+        """
+        Lay out the panel and its dirty descendants top-down. Layout requests
+        made by descendants while the panel is arranged are handled before
+        returning, the panel is only laid out again when a child resized
+        itself.
+        """
+        iterations = 0
+        while self.layout_dirty:
+            self.layout_dirty = False
+            self.children_dirtied = False
+            self.arranging = True
+            try:
+                self.layout(scheme, self.width, self.height)
+            finally:
+                self.arranging = False
+            if self.children_dirtied:
+                # Children requested layout after layout_children() ran or
+                # resized themselves.
+                self.layout_dirty = True
+            iterations += 1
+            if iterations > 100:
+                raise Exception("Maximum layout iterations reached.")
+
     def layout_children(self, scheme, w, h):
+        # Only children that requested layout are visited. Children made dirty
+        # while visiting are visited before returning. A child that resized
+        # itself may change how the panel places its children, so the panel is
+        # laid out again.
+        resized = False
+        while self.dirty_children:
+            dirty = self.dirty_children
+            self.dirty_children = dict()
+            for child in dirty:
+                if not child.visible:
+                    # Hidden children are registered again when shown.
+                    continue
+                if child.size_to_content:
+                    child.size = child.desired_size(w, h)
+                size = child.size
+                child.arrange(scheme)
+                if child.size != size:
+                    resized = True
+        self.children_dirtied = resized
+
+    @property
+    def surface_size(self):
+        return (int(self.width), int(self.height))
+
+    def prepare_render(self, visible, occluders, pool):
+        # Collect the damage of this panel and its render dirty descendants so
+        # that only damaged regions are recomposited. visible is the part of
+        # this panel, in local coordinates, that can end up on the screen.
+        # Anything outside of it is neither drawn nor kept up to date.
+        # occluders are rects, in local coordinates, covered by opaque panels
+        # higher in the z-order. Anything inside one of them is hidden. Child
+        # surfaces are borrowed from and returned to pool.
+
+        # Regions coming into view have never been drawn.
+        if not self.render_area.contains(visible):
+            self.add_render_damage(visible)
+        self.render_area = visible
+
+        # Regions that were hidden under an occluder are out of date once the
+        # occluder is gone.
+        if occluders != self.occluders:
+            for occluder in self.occluders:
+                if occluder not in occluders:
+                    self.add_render_damage(occluder)
+            self.occluders = occluders
+
+        # Opaque children cover their lower siblings.
+        covers = list(occluders)
+        # Evicted children that may not need to be rendered again, with the
+        # visible area and covers in this panel's coordinates.
+        evicted = []
+
+        for child in self.children:
+            # Hidden children leave their area and give up their surfaces.
+            if not child.visible:
+                if child.composited_rect is not None:
+                    self.add_damage(child.composited_rect)
+                    child.composited_rect = None
+                child.release_surface(pool)
+                continue
+
+            # Moved, resized, added and reordered children damage both the area
+            # they left and the area they now cover.
+            rect = pygame.Rect(child.x, child.y, child.width, child.height)
+            if child.composited_rect != rect:
+                if child.composited_rect is not None:
+                    self.add_damage(child.composited_rect)
+                self.add_damage(rect)
+                child.composited_rect = rect
+
+            # Children that are clipped or covered entirely are culled along
+            # with their surfaces.
+            child_visible = rect.clip(visible)
+            child_covers = [covers[i] for i in child_visible.collidelistall(covers)]
+            if (child_visible.w <= 0 or child_visible.h <= 0
+                    or any(cover.contains(child_visible) for cover in child_covers)):
+                child.release_surface(pool)
+                continue
+            if child.opaque:
+                covers.append(rect)
+
+            # Evicted children are rendered again only when they are damaged
+            # or their area is recomposited.
+            if child.surface_evicted and not child.render_dirty:
+                evicted.append((child, child_visible, child_covers))
+                continue
+
+            child_visible.move_ip(-child.x, -child.y)
+            child_covers = [cover.clip(rect).move(-child.x, -child.y) for cover in child_covers]
+            self.prepare_child(child, child_visible, child_covers, pool)
+
+        # Recompositing is clipped to the union of the damage, so evicted
+        # children anywhere inside of it are needed.
+        while evicted and self.damage:
+            clip = self.damage[0].unionall(self.damage[1:])
+            needed = [entry for entry in evicted if entry[1].colliderect(clip)]
+            if not needed:
+                break
+            for entry in needed:
+                evicted.remove(entry)
+                child, child_visible, child_covers = entry
+                child_visible.move_ip(-child.x, -child.y)
+                child_covers = [cover.clip(child.composited_rect).move(-child.x, -child.y)
+                                for cover in child_covers]
+                self.prepare_child(child, child_visible, child_covers, pool)
+
+        self.damage = clip_damage(self.damage, visible, occluders)
+        self.background_damage = clip_damage(self.background_damage, visible, occluders)
+        if not self.damage:
+            self.render_dirty = False
+
+    def prepare_child(self, child, child_visible, child_covers, pool):
+        # Borrow a new surface if needed. Opaque panels do not need
+        # per-pixel alpha.
+        alpha = not child.opaque
+        if (child.surface is None
+                or child.surface.get_size() != child.surface_size
+                or bool(child.surface.get_flags() & pygame.SRCALPHA) != alpha):
+            if child.surface is not None:
+                pool.release(child.surface)
+            child.surface = pool.acquire(child.surface_size, alpha=alpha, owner=child)
+            child.render_area = pygame.Rect(0, 0, 0, 0)
+            child.surface_evicted = False
+        else:
+            pool.touch(child.surface)
+
+        # Only panels with children need a separate background layer.
+        if child.children:
+            if (child.background is None
+                    or child.background.get_size() != child.surface_size
+                    or bool(child.background.get_flags() & pygame.SRCALPHA) != alpha):
+                if child.background is not None:
+                    pool.release(child.background)
+                child.background = pool.acquire(child.surface_size, alpha=alpha, owner=child)
+                child.render_area = pygame.Rect(0, 0, 0, 0)
+            else:
+                pool.touch(child.background)
+        elif child.background is not None:
+            pool.release(child.background)
+            child.background = None
+
+        if (child.render_dirty
+                or not child.render_area.contains(child_visible)
+                or child.occluders != child_covers):
+            child.prepare_render(child_visible, child_covers, pool)
+            if child.render_dirty:
+                pool.mark_drawn(child.surface)
+                if child.background is not None:
+                    pool.mark_drawn(child.background)
+            for damaged in child.damage:
+                self.add_damage(damaged.move(child.x, child.y))
+
+    def evict_surface(self, pool):
+        # Give up the surfaces but keep the pixels composited in the parent.
+        # The panel is rendered again once they are needed.
+        if self.surface is not None:
+            pool.release(self.surface)
+            self.surface = None
+        if self.background is not None:
+            pool.release(self.background)
+            self.background = None
+        self.render_area = pygame.Rect(0, 0, 0, 0)
+        self.occluders = []
+        self.damage = []
+        self.background_damage = []
+        self.surface_evicted = True
+
+    def release_surface(self, pool):
+        if self.surface is None and not self.surface_evicted:
+            return
+        self.evict_surface(pool)
+        self.surface_evicted = False
+        # Render requests stop here until the panel is visible again.
+        self.render_dirty = True
         for child in self.children:
-            iterations = 0
-            while child.layout_dirty:
-                child.layout_dirty = False
-                child.process_move_queue()
-                child.layout(scheme, child.width, child.height)
-                iterations += 1
-                if iterations > 100:
-                    raise Exception("Maximum layout iterations reached.")
+            child.release_surface(pool)
 
     def render(self, scheme, surface, clock, w, h):
         scheme.render_panel(self, surface, clock, w, h)
 
+    def redraw(self, scheme, clock):
+        # Only the damaged area is redrawn.
+        clip = self.damage[0].unionall(self.damage[1:])
+        if self.background is None:
+            self.surface.set_clip(clip)
+            self.surface.fill((0, 0, 0, 0))
+            self.render(scheme, self.surface, clock, self.width, self.height)
+            self.surface.set_clip(None)
+        else:
+            # Redraw the panel's own drawing into the background layer
+            # without its children, then composite the children over a copy
+            # of the background.
+            if self.background_damage:
+                self.background.set_clip(
+                        self.background_damage[0].unionall(self.background_damage[1:]))
+                self.background.fill((0, 0, 0, 0))
+                self.rendering_background = True
+                self.render(scheme, self.background, clock, self.width, self.height)
+                self.rendering_background = False
+                self.background.set_clip(None)
+            self.surface.set_clip(clip)
+            self.surface.fill((0, 0, 0, 0))
+            self.surface.blit(self.background, (0, 0), special_flags=pygame.BLEND_RGBA_MAX)
+            self.render_children(scheme, self.surface, clock, self.width, self.height)
+            self.surface.set_clip(None)
+        self.render_dirty = False
+        self.damage = []
+        self.background_damage = []
+
     def render_children(self, scheme, surface, clock, w, h):
+        # Children are composited after the background layer is drawn.
+        if self.rendering_background:
+            return
+
         # The last drawn child will on top and the first child in the list
         # is the top panel, so we render in reverse order.
         for child in reversed(self.children):
-            # Create a new surface if needed.
-            if child.surface == None or child.surface.get_size() != child.size:
-                child.surface = pygame.Surface(child.size, pygame.SRCALPHA)
-                child.render_dirty = True
+            # Culled children have no surface.
+            if child.surface is None:
+                continue
 
             if child.render_dirty:
-                child.surface.fill((0, 0, 0, 0))
-                # Render the child.
-                child.render(
-                        scheme,
-                        child.surface,
-                        clock,
-                        child.width,
-                        child.height)
-
-            # Render child surface to parent surface.
+                child.redraw(scheme, clock)
+
+            # Render child surface to parent surface. The parent surface is
+            # clipped to its own damage so undamaged areas are left alone.
             self.surface.blit(child.surface, (child.x, child.y))
 
         self.render_dirty = False
@@ -416,7 +933,7 @@ class PanelRectTest(RectTest):
 class PanelTest(unittest.TestCase):
 
     def setUp(self):
-        from gui.gui import Gui
+        from desky.gui import Gui
         self.gui = Gui()
         self.panel = self.gui.create(Panel)
         self.panel.rect = Rect(50, 80, 100, 120)
@@ -491,23 +1008,31 @@ class PanelTest(unittest.TestCase):
 
     def test_x(self):
         self.assertEqual(50, self.panel.x)
+        self.gui.world.render_dirty = False
         self.panel.x = 127
         self.assertEqual(Rect(127, 80, 100, 120), self.panel.rect)
-        self.assertTrue(self.panel.layout_dirty)
+        self.assertFalse(self.panel.layout_dirty)
+        self.assertFalse(self.gui.world.layout_dirty)
+        self.assertTrue(self.gui.world.render_dirty)
 
-        self.panel.layout_dirty = False
-        self.panel.x = 127
+        self.gui.world.layout_on_child_move = True
+        self.panel.x = 0
         self.assertFalse(self.panel.layout_dirty)
+        self.assertTrue(self.gui.world.layout_dirty)
 
     def test_y(self):
         self.assertEqual(80, self.panel.y)
+        self.gui.world.render_dirty = False
         self.panel.y = 127
         self.assertEqual(Rect(50, 127, 100, 120), self.panel.rect)
-        self.assertTrue(self.panel.layout_dirty)
+        self.assertFalse(self.panel.layout_dirty)
+        self.assertFalse(self.gui.world.layout_dirty)
+        self.assertTrue(self.gui.world.render_dirty)
 
-        self.panel.layout_dirty = False
-        self.panel.y = 127
+        self.gui.world.layout_on_child_move = True
+        self.panel.y = 0
         self.assertFalse(self.panel.layout_dirty)
+        self.assertTrue(self.gui.world.layout_dirty)
 
     def test_width(self):
         self.assertEqual(100, self.panel.width)
@@ -533,10 +1058,6 @@ class PanelTest(unittest.TestCase):
         self.assertEqual((50, 80), self.panel.pos)
         self.panel.pos = (127, 99)
         self.assertEqual(Rect(127, 99, 100, 120), self.panel.rect)
-        self.assertTrue(self.panel.layout_dirty)
-
-        self.panel.layout_dirty = False
-        self.panel.pos = (127, 99)
         self.assertFalse(self.panel.layout_dirty)
 
     def test_size(self):
@@ -555,15 +1076,15 @@ class PanelTest(unittest.TestCase):
         self.assertFalse(self.panel.layout_dirty)
 
         parent = self.gui.create(Panel)
-        self.assertTrue(self.gui.world.layout_dirty)
-        self.gui.world.layout_dirty = False
+        self.gui.layout(1000, 1000)
 
+        # Reparenting is queued and applied by the next layout.
         self.panel.parent = parent
+        self.assertIn(self.panel, self.gui.world.children)
+        self.assertTrue(parent.layout_dirty)
+        self.gui.layout(1000, 1000)
         self.assertNotIn(self.panel, self.gui.world.children)
         self.assertIn(self.panel, parent.children)
-        self.assertTrue(self.panel.layout_dirty)
-        self.assertTrue(parent.layout_dirty)
-        self.assertTrue(self.gui.world.layout_dirty)
 
     def test_request_layout(self):
         self.assertFalse(self.panel.layout_dirty)
@@ -572,6 +1093,201 @@ class PanelTest(unittest.TestCase):
         self.assertTrue(self.panel.layout_dirty)
         self.assertTrue(self.gui.world.layout_dirty)
 
+    def render(self):
+        self.gui.layout(640, 480)
+        return self.gui.render(self.screen, None)
+
+    def record_renders(self):
+        # Returns the list of panels the scheme draws from now on.
+        rendered = []
+        render_panel = self.gui.scheme.render_panel
+        def counting_render_panel(panel, surface, clock, w, h):
+            rendered.append(panel)
+            render_panel(panel, surface, clock, w, h)
+        self.gui.scheme.render_panel = counting_render_panel
+        return rendered
+
+    def test_render_damage(self):
+        self.screen = pygame.Surface((640, 480))
+        self.gui.world.request_layout()
+        self.assertEqual([pygame.Rect(0, 0, 640, 480)], self.render())
+        self.assertEqual([], self.render())
+
+        self.panel.request_render()
+        self.assertEqual([pygame.Rect(50, 80, 100, 120)], self.render())
+        self.assertEqual([], self.render())
+
+    def test_render_region_damage(self):
+        self.screen = pygame.Surface((640, 480))
+        self.gui.world.request_layout()
+        self.render()
+
+        self.panel.request_render((10, 20, 5, 5))
+        self.assertEqual([pygame.Rect(60, 100, 5, 5)], self.render())
+
+        # Regions are clipped to the panel.
+        self.panel.request_render((90, 110, 50, 50))
+        self.assertEqual([pygame.Rect(140, 190, 10, 10)], self.render())
+        self.panel.request_render((200, 200, 5, 5))
+        self.assertEqual([], self.render())
+
+    def test_visible(self):
+        self.screen = pygame.Surface((640, 480))
+        self.gui.world.request_layout()
+        self.render()
+
+        self.panel.visible = False
+        self.assertEqual([pygame.Rect(50, 80, 100, 120)], self.render())
+        self.assertIsNone(self.panel.surface)
+        self.gui.find_hover(60, 90)
+        self.assertIs(self.gui.world, self.gui.hover)
+
+        # Layout requests made while hidden are applied when shown.
+        self.panel.request_layout()
+        self.render()
+        self.assertTrue(self.panel.layout_dirty)
+        self.panel.visible = True
+        self.assertTrue(self.gui.world.layout_dirty)
+        self.assertEqual([pygame.Rect(50, 80, 100, 120)], self.render())
+        self.assertFalse(self.panel.layout_dirty)
+        self.assertIsNotNone(self.panel.surface)
+
+    def test_render_eviction(self):
+        self.screen = pygame.Surface((640, 480))
+        other = self.gui.create(Panel)
+        other.rect = (300, 300, 20, 20)
+        self.gui.world.request_layout()
+        self.render()
+
+        # Surfaces drawn to in the last render are kept over budget.
+        pool = self.gui.surface_pool
+        pool.max_borrowed_bytes = 0
+        other.request_render()
+        self.render()
+        self.assertIsNone(self.panel.surface)
+        self.assertIsNotNone(other.surface)
+        self.assertEqual(pool.surface_bytes(other.surface.get_parent()), pool.borrowed_bytes)
+
+        rendered = self.record_renders()
+
+        # Evicted panels are only rendered again when their area is damaged.
+        other.request_render()
+        self.assertEqual([pygame.Rect(300, 300, 20, 20)], self.render())
+        self.assertNotIn(self.panel, rendered)
+        other.pos = (90, 100)
+        self.render()
+        self.assertIn(self.panel, rendered)
+
+    def test_children_at(self):
+        children = []
+        for i in range(SpatialIndex.min_children * 2):
+            child = self.gui.create(Panel)
+            child.parent = self.panel
+            child.rect = (0, i * 10, 50, 10)
+            children.append(child)
+        self.gui.layout(640, 480)
+        self.assertEqual([children[2]], self.panel.children_at(5, 25))
+        self.assertIsNotNone(self.panel.hit_index)
+
+        children[0].rect = (0, 20, 50, 10)
+        self.assertEqual([children[2], children[0]], self.panel.children_at(5, 25))
+        children[0].visible = False
+        self.assertEqual([children[2]], self.panel.children_at(5, 25))
+
+    def test_reorder_hit_index(self):
+        children = []
+        for i in range(SpatialIndex.min_children * 2):
+            child = self.gui.create(Panel)
+            child.parent = self.panel
+            child.rect = (0, i * 10, 50, 10)
+            children.append(child)
+        children[0].rect = (0, 20, 50, 10)
+        self.gui.layout(640, 480)
+        self.assertEqual([children[2], children[0]], self.panel.children_at(5, 25))
+        index = self.panel.hit_index
+
+        # Moving a panel that is already in place does nothing.
+        generation = Panel.hit_generation
+        self.panel.children[0].move_to_front()
+        self.assertEqual([], self.gui.move_queue)
+        self.assertEqual(generation, Panel.hit_generation)
+
+        children[0].move_to_front()
+        self.gui.layout(640, 480)
+        self.assertEqual([children[0], children[2]], self.panel.children_at(5, 25))
+        children[0].move_to_back()
+        self.gui.layout(640, 480)
+        self.assertEqual([children[2], children[0]], self.panel.children_at(5, 25))
+        self.assertIs(index, self.panel.hit_index)
+
+    def test_render_move_damage(self):
+        self.screen = pygame.Surface((640, 480))
+        self.gui.world.request_layout()
+        self.render()
+
+        self.panel.x = 70
+        self.assertEqual(
+                [pygame.Rect(50, 80, 100, 120), pygame.Rect(70, 80, 100, 120)],
+                self.render())
+
+        self.panel.remove()
+        self.assertEqual([pygame.Rect(70, 80, 100, 120)], self.render())
+
+    def test_render_culling(self):
+        self.screen = pygame.Surface((640, 480))
+        self.gui.world.request_layout()
+        child = self.gui.create(Panel)
+        child.parent = self.panel
+        child.rect = (90, 100, 50, 50)
+        self.render()
+        self.assertIsNotNone(child.surface)
+        self.assertEqual(pygame.Rect(0, 0, 10, 20), child.render_area)
+
+        self.panel.x = 700
+        self.render()
+        self.assertIsNone(self.panel.surface)
+        self.assertIsNone(child.surface)
+
+        self.panel.x = 600
+        self.assertEqual([pygame.Rect(600, 80, 40, 120)], self.render())
+        self.assertEqual(pygame.Rect(0, 0, 40, 120), self.panel.render_area)
+        self.assertIsNone(child.surface)
+
+    def test_render_occlusion(self):
+        self.screen = pygame.Surface((640, 480))
+        self.gui.world.request_layout()
+        cover = self.gui.create(Panel)
+        cover.rect = (40, 70, 200, 200)
+        cover.opaque = True
+        self.render()
+        self.assertIsNotNone(cover.surface)
+        self.assertIsNone(self.panel.surface)
+
+        # Damage underneath an opaque panel is not recomposited.
+        self.panel.request_render()
+        self.assertEqual([], self.render())
+
+        cover.x = 300
+        self.render()
+        self.assertIsNotNone(self.panel.surface)
+
+    def test_render_background_cache(self):
+        self.screen = pygame.Surface((640, 480))
+        self.gui.world.request_layout()
+        child = self.gui.create(Panel)
+        child.parent = self.panel
+        child.rect = (10, 10, 20, 20)
+        self.render()
+        self.assertIsNotNone(self.panel.background)
+
+        rendered = self.record_renders()
+
+        # The parent's own drawing is reused when only a child changes.
+        child.request_render()
+        self.assertEqual([pygame.Rect(60, 90, 20, 20)], self.render())
+        self.assertIn(child, rendered)
+        self.assertNotIn(self.panel, rendered)
+
 if __name__ == "__main__":
     unittest.main()
 
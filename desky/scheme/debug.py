@@ -60,7 +60,9 @@ class DebugScheme(Scheme):
         _, _, tw, th = panel.font.get_rect(panel.text)
         x = panel.align[0] * (w - tw) + panel.offset[0]
         y = panel.align[1] * (h - th) + panel.offset[1]
-        panel.font.render_to(surface, (x, y), panel.text, color)
+        # Blit rendered text since render_to ignores the surface clip.
+        textsurf, _ = panel.font.render(panel.text, color)
+        surface.blit(textsurf, (x, y))
 
     def render_label(self, panel, surface, clock, w, h):
         self.render_panel_background(panel, surface, clock, w, h)
@@ -118,15 +120,13 @@ class DebugScheme(Scheme):
     def render_context_menu_sub_item(self, panel, surface, clock, w, h):
         self.render_text_button(panel, surface, clock, w, h)
 
+    def measure_context_menu_panel(self, panel, w, h):
+        # The menu keeps its width and is as tall as its items.
+        height = panel.dock_layout.measure(panel, w, h)[1]
+        return (max(panel.width, 10), max(height, 10))
+
     def layout_context_menu_panel(self, panel, w, h):
         panel.dock_layout.layout(panel)
-        width, height = 10, 10
-        for child in panel.children:
-            if child.rect.right > width:
-                width = child.rect.right
-            if child.rect.bottom > height:
-                height = child.rect.bottom
-        panel.size = (width, height)
         panel.layout_children(self, w, h)
 
     def render_context_menu_panel(self, panel, surface, clock, w, h):
@@ -178,6 +178,8 @@ class DebugScheme(Scheme):
         panel.backpanel = gui.create(Panel)
         panel.backpanel.parent = panel
         panel.parent_panel = panel.backpanel
+        # The scroll height depends on the positions of the scrolled children.
+        panel.backpanel.layout_on_child_move = True
 
     def layout_scroll_panel(self, panel, w, h):
         height = 0
@@ -81,7 +81,9 @@ class DefaultScheme(DebugScheme):
         _, _, tw, th = panel.font.get_rect(panel.text)
         x = panel.align[0] * (w - tw) + panel.offset[0]
         y = panel.align[1] * (h - th) + panel.offset[1]
-        panel.font.render_to(surface, (x, y), panel.text, color)
+        # Blit rendered text since render_to ignores the surface clip.
+        textsurf, _ = panel.font.render(panel.text, color)
+        surface.blit(textsurf, (x, y))
 
     def render_label(self, panel, surface, clock, w, h):
         self.render_panel_background(panel, surface, clock, w, h)
@@ -91,6 +93,9 @@ class DefaultScheme(DebugScheme):
     ############################################################################
     # Text Button
     ############################################################################
+    def setup_text_button(self, panel, gui):
+        panel.opaque = True
+
     def render_text_button_background(self, panel, surface, clock, w, h):
         colors = self.colors_button[panel.state]
         pygame.draw.rect(surface, colors["border"], pygame.Rect(0, 0, w, h))
@@ -127,6 +132,9 @@ class DefaultScheme(DebugScheme):
     ############################################################################
     # Text Entry
     ############################################################################
+    def setup_text_entry(self, panel, gui):
+        panel.opaque = True
+
     def render_text_entry_background(self, panel, surface, clock, w, h):
         colors = self.colors_text_entry["focus" if panel.focus else "normal"]
         pygame.draw.rect(surface, colors["border"], pygame.Rect(0, 0, w, h))
@@ -142,6 +150,12 @@ class DefaultScheme(DebugScheme):
     ############################################################################
     # Context Menu
     ############################################################################
+    def setup_context_menu_item(self, panel, gui):
+        panel.opaque = True
+
+    def setup_context_menu_sub_item(self, panel, gui):
+        panel.opaque = True
+
     def render_context_menu_item(self, panel, surface, clock, w, h):
         self.render_text_button(panel, surface, clock, w, h)
 
@@ -150,13 +164,6 @@ class DefaultScheme(DebugScheme):
 
     def layout_context_menu_panel(self, panel, w, h):
         panel.dock_layout.layout(panel)
-        width, height = 10, 10
-        for child in panel.children:
-            if child.rect.right > width:
-                width = child.rect.right
-            if child.rect.bottom > height:
-                height = child.rect.bottom
-        panel.size = (width, height)
 
     def render_context_menu_panel(self, panel, surface, clock, w, h):
         self.render_panel_background(panel, surface, clock, w, h)
@@ -165,6 +172,13 @@ class DefaultScheme(DebugScheme):
     ############################################################################
     # Scroll Bar
     ############################################################################
+    def setup_scroll_bar_button(self, panel, gui):
+        panel.opaque = True
+
+    def setup_scroll_bar(self, panel, gui):
+        super().setup_scroll_bar(panel, gui)
+        panel.opaque = True
+
     def render_scroll_bar_background(self, panel, surface, clock, w, h):
         pygame.draw.rect(surface, (59, 59, 59), pygame.Rect(0, 0, w, h))
 
@@ -175,6 +189,10 @@ class DefaultScheme(DebugScheme):
     ############################################################################
     # Scroll Panel
     ############################################################################
+    def setup_scroll_panel(self, panel, gui):
+        super().setup_scroll_panel(panel, gui)
+        panel.opaque = True
+
     def render_scroll_panel_background(self, panel, surface, clock, w, h):
         pygame.draw.rect(surface, (41, 41, 41), pygame.Rect(0, 0, w, h))
 
@@ -4,7 +4,8 @@ import pygame
 from desky.button import ButtonState
 
 class Scheme:
-    pass
+    # Allocate panel surfaces in the display's pixel format.
+    display_format_surfaces = True
 
 def add_default_methods(clsname):
     def default_setup(self, panel, gui):
@@ -15,6 +16,10 @@ def add_default_methods(clsname):
         panel.layout_children(self, w, h)
     setattr(Scheme, "layout_" + clsname, default_layout)
 
+    def default_measure(self, panel, w, h):
+        return (panel.width, panel.height)
+    setattr(Scheme, "measure_" + clsname, default_measure)
+
     def default_render(self, panel, surface, clock, w, h):
         panel.render_children(self, surface, clock, w, h)
     setattr(Scheme, "render_" + clsname, default_render)
@@ -38,18 +43,10 @@ def render_text_entry_text(panel, surface, clock, w, h):
     ascender = panel.font.get_sized_ascender()
     descender = panel.font.get_sized_descender()
     th = panel.font.get_sized_height()
-    _, _, startx, _ = panel.font.get_rect(panel.text[:panel.caret])
     basex, basey, _, _ = panel.font.get_rect(panel.text)
 
     # Update the view.
-    if panel.caret == 0:
-        panel.viewx = -panel.xoffset
-    else:
-        if startx - panel.viewx > panel.width:
-            panel.viewx = startx - int(panel.width * 0.66)
-        if startx - panel.viewx < 0:
-            panel.viewx = startx - int(panel.width * 0.33)
-        panel.viewx = max(panel.viewx, -panel.xoffset)
+    panel.scroll_to_caret()
 
     # Draw main text portion.
     x = -panel.viewx
@@ -45,18 +45,31 @@ class ScrollBar(Panel):
         self.scroll(y / self.view_height * self.total_height - self.view_height / 2)
 
     def mouse_press(self, event):
-        if event.hover and event.button == 1:
+        if event.button != 1:
+            return
+        # Pressing the bar jumps to the pressed position, pressing the button
+        # keeps the grabbed point under the mouse. Either way the drag holds
+        # the pointer until release.
+        if event.hover:
             self.move_to(event.y)
             self.button.state = ButtonState.PRESSED
             self.drag_offset = 0
+            event.gui.capture_pointer(self)
+        elif event.gui.hover is self.button:
+            self.drag_offset = self.button.y + self.button.height / 2 - event.y
+            event.gui.capture_pointer(self)
 
-    def mouse_move(self, event):
-        if self.button.state == ButtonState.PRESSED and self.scroll:
-            if self.drag_offset is None:
-                self.drag_offset = self.button.y + self.button.height / 2 - event.y
+    def mouse_drag(self, event):
+        if self.scroll:
             self.move_to(event.y + self.drag_offset)
-        else:
-            self.drag_offset = None
+
+    def mouse_release(self, event):
+        if event.gui.pointer_capture is self and event.button == 1:
+            event.gui.release_pointer()
+            # The button does not see the release while the bar holds the
+            # pointer.
+            self.button.state = ButtonState.HOVER if self.button.hover else ButtonState.NORMAL
+            event.gui.remove_global_listener(self.button)
 
 class ScrollPanel(Panel):
 
@@ -64,6 +77,8 @@ class ScrollPanel(Panel):
         super().__init__()
         self.backpanel = None
         self.scrollbar = None
+        # The scroll bar follows the backpanel as it scrolls.
+        self.layout_on_child_move = True
 
     @property
     def view_offset(self):
@@ -76,9 +91,9 @@ class ScrollPanel(Panel):
     def mouse_press(self, event):
         if event.inside:
             if event.button == 4:
-                self.view_offset = self.view_offset - 20
+                self.view_offset = self.view_offset - 20 * event.steps
             elif event.button == 5:
-                self.view_offset = self.view_offset + 20
+                self.view_offset = self.view_offset + 20 * event.steps
 
     def setup(self, scheme, gui):
         scheme.setup_scroll_panel(self, gui)
@@ -0,0 +1,159 @@
+
+import math
+import unittest
+
+class SpatialIndex:
+    """
+    SpatialIndex is a uniform grid over the rects of a panel's children used
+    to hit test wide panels without testing every child. Children whose rects
+    moved or resized are marked with invalidate() and indexed again on the
+    next query. Children moved to the front or back are reordered in place,
+    adding or removing children requires a new index.
+    """
+
+    # Panels with fewer children than this are hit tested linearly.
+    min_children = 16
+    # Rects spanning more cells than this are tested on every query.
+    max_cells = 64
+
+    def __init__(self, children, *, cell_size=64):
+        self.cell_size = cell_size
+        # Z-order of the children, lowest first. Only the relative order of
+        # the values matters.
+        self.order = {child: index for index, child in enumerate(children)}
+        self.front = 0
+        self.back = len(children) - 1
+        # Children by (column, row) cell.
+        self.cells = dict()
+        # Children too large to put in cells.
+        self.large = set()
+        # Cells of each indexed child, None for large children.
+        self.indexed = dict()
+        # Children that changed since they were indexed.
+        self.stale = set()
+        for child in children:
+            self.insert(child)
+
+    def cell_keys(self, rect):
+        x0 = math.floor(rect.x / self.cell_size)
+        y0 = math.floor(rect.y / self.cell_size)
+        x1 = math.floor(rect.right / self.cell_size)
+        y1 = math.floor(rect.bottom / self.cell_size)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) > self.max_cells:
+            return None
+        return [(x, y) for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)]
+
+    def insert(self, child):
+        keys = self.cell_keys(child.rect)
+        self.indexed[child] = keys
+        if keys is None:
+            self.large.add(child)
+            return
+        for key in keys:
+            self.cells.setdefault(key, set()).add(child)
+
+    def remove(self, child):
+        keys = self.indexed.pop(child)
+        if keys is None:
+            self.large.discard(child)
+            return
+        for key in keys:
+            cell = self.cells[key]
+            cell.discard(child)
+            if not cell:
+                del self.cells[key]
+
+    def invalidate(self, child):
+        if child in self.order:
+            self.stale.add(child)
+
+    def move_to_front(self, child):
+        self.front -= 1
+        self.order[child] = self.front
+
+    def move_to_back(self, child):
+        self.back += 1
+        self.order[child] = self.back
+
+    def refresh(self):
+        for child in self.stale:
+            self.remove(child)
+            self.insert(child)
+        self.stale.clear()
+
+    def query(self, x, y):
+        """Return the children containing the point, top first."""
+        self.refresh()
+        key = (math.floor(x / self.cell_size), math.floor(y / self.cell_size))
+        candidates = self.cells.get(key, set()) | self.large
+        hits = [child for child in candidates if child.rect.contains_point(x, y)]
+        hits.sort(key=self.order.__getitem__)
+        return hits
+
+    def overlapping(self, rect):
+        """Return the children intersecting the rect, top first."""
+        self.refresh()
+        keys = self.cell_keys(rect)
+        if keys is None:
+            candidates = set(self.indexed)
+        else:
+            candidates = set(self.large)
+            for key in keys:
+                candidates |= self.cells.get(key, set())
+        hits = [child for child in candidates if child.rect.intersects(rect)]
+        hits.sort(key=self.order.__getitem__)
+        return hits
+
+    def cell_rect(self, x, y):
+        """Return the (x, y, w, h) cell containing the point."""
+        return (math.floor(x / self.cell_size) * self.cell_size,
+                math.floor(y / self.cell_size) * self.cell_size,
+                self.cell_size, self.cell_size)
+
+class SpatialIndexTest(unittest.TestCase):
+
+    class Child:
+        def __init__(self, x, y, w, h):
+            from desky.rect import Rect
+            self.rect = Rect(x, y, w, h)
+
+    def test_query(self):
+        children = [self.Child(x * 20, y * 20, 20, 20) for y in range(10) for x in range(10)]
+        index = SpatialIndex(children)
+        self.assertEqual([children[23]], index.query(65, 45))
+        self.assertEqual([], index.query(-5, 45))
+
+    def test_order(self):
+        top = self.Child(60, 40, 10, 10)
+        large = self.Child(0, 0, 1000, 1000)
+        bottom = self.Child(0, 0, 100, 100)
+        index = SpatialIndex([top, large, bottom])
+        self.assertIn(large, index.large)
+        self.assertEqual([top, large, bottom], index.query(65, 45))
+
+    def test_overlapping(self):
+        children = [self.Child(x * 20, y * 20, 20, 20) for y in range(10) for x in range(10)]
+        index = SpatialIndex(children)
+        from desky.rect import Rect
+        self.assertEqual([children[23], children[24], children[33], children[34]],
+                index.overlapping(Rect(65, 45, 20, 20)))
+        self.assertEqual((64, 0, 64, 64), index.cell_rect(65, 45))
+
+    def test_move(self):
+        children = [self.Child(0, 0, 20, 20) for _ in range(3)]
+        index = SpatialIndex(children)
+        index.move_to_front(children[2])
+        self.assertEqual([children[2], children[0], children[1]], index.query(10, 10))
+        index.move_to_back(children[0])
+        self.assertEqual([children[2], children[1], children[0]], index.query(10, 10))
+
+    def test_invalidate(self):
+        child = self.Child(0, 0, 20, 20)
+        index = SpatialIndex([child])
+        child.rect.x = 300
+        index.invalidate(child)
+        self.assertEqual([], index.query(10, 10))
+        self.assertEqual([child], index.query(310, 10))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,192 @@
+
+import unittest
+from collections import OrderedDict
+
+import pygame
+
+def bucket_length(length):
+    # Round up to a multiple of an eighth of the next power of two so that
+    # small size changes, such as dragging a divider, land in the same bucket.
+    if length <= 16:
+        return 16
+    step = (1 << (length - 1).bit_length()) // 8
+    return -(-length // step) * step
+
+class SurfacePool:
+    """
+    SurfacePool hands out panel surfaces and takes them back for reuse.
+    Surfaces are allocated in size buckets and handed out as subsurfaces of the
+    requested size, so resizing a panel within its bucket does not allocate.
+    Released surfaces are kept up to max_free_bytes, evicting the least
+    recently released first.
+
+    When display_format is set and a display mode has been set, surfaces are
+    allocated in the display's pixel format so blitting them does not need a
+    format conversion.
+
+    Surfaces handed out are limited to max_borrowed_bytes by evict(), which
+    asks the owners of the least recently used surfaces to give them up.
+    Surfaces drawn to since the last evict() are kept, as evicting them would
+    only reallocate them the next time they change.
+    """
+
+    def __init__(self, *, max_free_bytes=32 * 1024 * 1024,
+            max_borrowed_bytes=128 * 1024 * 1024, display_format=True):
+        self.max_free_bytes = max_free_bytes
+        self.max_borrowed_bytes = max_borrowed_bytes
+        self.display_format = display_format
+        self.free_bytes = 0
+        self.borrowed_bytes = 0
+        # Free surfaces by (width, height, alpha, display format) bucket.
+        self.free = dict()
+        # Free surfaces in release order for eviction.
+        self.free_order = OrderedDict()
+        # Buckets of the surfaces currently handed out, least recently used
+        # first.
+        self.borrowed = OrderedDict()
+        # Owners of the surfaces currently handed out.
+        self.owners = dict()
+        # Surfaces drawn to since the last evict().
+        self.drawn = set()
+
+    def bucket(self, size, alpha):
+        display_format = self.display_format and pygame.display.get_surface() is not None
+        return (bucket_length(int(size[0])), bucket_length(int(size[1])), alpha, display_format)
+
+    def allocate(self, key):
+        w, h, alpha, display_format = key
+        if not display_format:
+            return pygame.Surface((w, h), pygame.SRCALPHA if alpha else 0)
+        elif alpha:
+            return pygame.Surface((w, h), pygame.SRCALPHA).convert_alpha()
+        else:
+            return pygame.Surface((w, h), 0, pygame.display.get_surface())
+
+    def acquire(self, size, *, alpha=True, owner=None):
+        key = self.bucket(size, alpha)
+        surfaces = self.free.get(key)
+        if surfaces:
+            backing = surfaces.pop()
+            del self.free_order[backing]
+            self.free_bytes -= self.surface_bytes(backing)
+        else:
+            backing = self.allocate(key)
+        self.borrowed[backing] = key
+        self.borrowed_bytes += self.surface_bytes(backing)
+        if owner is not None:
+            self.owners[backing] = owner
+        return backing.subsurface(pygame.Rect(0, 0, int(size[0]), int(size[1])))
+
+    def release(self, surface):
+        backing = surface.get_parent()
+        key = self.borrowed.pop(backing)
+        self.owners.pop(backing, None)
+        self.drawn.discard(backing)
+        self.borrowed_bytes -= self.surface_bytes(backing)
+        self.free.setdefault(key, []).append(backing)
+        self.free_order[backing] = key
+        self.free_bytes += self.surface_bytes(backing)
+
+        # Evict the least recently released surfaces.
+        while self.free_bytes > self.max_free_bytes:
+            backing, key = self.free_order.popitem(last=False)
+            self.free[key].remove(backing)
+            self.free_bytes -= self.surface_bytes(backing)
+
+    def touch(self, surface):
+        self.borrowed.move_to_end(surface.get_parent())
+
+    def mark_drawn(self, surface):
+        self.drawn.add(surface.get_parent())
+
+    def evict(self):
+        # Owners give up their surfaces through evict_surface(pool), which
+        # must release every surface they hold.
+        drawn = self.drawn
+        self.drawn = set()
+        for backing in list(self.borrowed):
+            if self.borrowed_bytes <= self.max_borrowed_bytes:
+                break
+            if backing in drawn:
+                continue
+            owner = self.owners.get(backing)
+            if owner is not None:
+                owner.evict_surface(self)
+
+    def surface_bytes(self, surface):
+        return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+    def clear(self):
+        self.free = dict()
+        self.free_order = OrderedDict()
+        self.free_bytes = 0
+
+class SurfacePoolTest(unittest.TestCase):
+
+    def test_bucket_length(self):
+        self.assertEqual(16, bucket_length(1))
+        self.assertEqual(16, bucket_length(16))
+        self.assertEqual(24, bucket_length(24))
+        self.assertEqual(112, bucket_length(100))
+        self.assertEqual(224, bucket_length(201))
+        self.assertEqual(640, bucket_length(640))
+
+    def test_reuse(self):
+        pool = SurfacePool()
+        surface = pool.acquire((200, 30))
+        self.assertEqual((200, 30), surface.get_size())
+        backing = surface.get_parent()
+        pool.release(surface)
+
+        surface = pool.acquire((210, 29))
+        self.assertEqual((210, 29), surface.get_size())
+        self.assertIs(backing, surface.get_parent())
+        self.assertEqual(0, pool.free_bytes)
+
+    def test_eviction(self):
+        pool = SurfacePool(max_free_bytes=64 * 64 * 4 * 2)
+        surfaces = [pool.acquire((64, 64)) for _ in range(3)]
+        backings = [surface.get_parent() for surface in surfaces]
+        for surface in surfaces:
+            pool.release(surface)
+        self.assertEqual(64 * 64 * 4 * 2, pool.free_bytes)
+        self.assertNotIn(backings[0], pool.free_order)
+        self.assertIn(backings[2], pool.free_order)
+
+    def test_evict(self):
+        class Owner:
+            def __init__(self, pool):
+                self.surface = pool.acquire((64, 64), owner=self)
+            def evict_surface(self, pool):
+                pool.release(self.surface)
+                self.surface = None
+
+        pool = SurfacePool(max_borrowed_bytes=64 * 64 * 4 * 2)
+        owners = [Owner(pool) for _ in range(3)]
+        pool.touch(owners[0].surface)
+        pool.evict()
+        self.assertEqual(64 * 64 * 4 * 2, pool.borrowed_bytes)
+        self.assertIsNotNone(owners[0].surface)
+        self.assertIsNone(owners[1].surface)
+        self.assertIsNotNone(owners[2].surface)
+
+        # Surfaces drawn to since the last eviction are kept over budget.
+        pool.max_borrowed_bytes = 0
+        pool.mark_drawn(owners[0].surface)
+        pool.evict()
+        self.assertIsNotNone(owners[0].surface)
+        self.assertIsNone(owners[2].surface)
+        pool.evict()
+        self.assertIsNone(owners[0].surface)
+
+    def test_opaque(self):
+        pool = SurfacePool()
+        surface = pool.acquire((30, 30), alpha=False)
+        self.assertFalse(surface.get_flags() & pygame.SRCALPHA)
+        pool.release(surface)
+
+        surface = pool.acquire((30, 30))
+        self.assertTrue(surface.get_flags() & pygame.SRCALPHA)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -50,8 +50,6 @@ ignore_keys = [
 ]
 
 @render_attribute("text", "")
-@render_attribute("caret", 0)
-@render_attribute("select_start", 0)
 @render_attribute("viewx", 0)
 @render_attribute("xoffset", 6)
 class TextEntry(Panel):
@@ -63,6 +61,8 @@ class TextEntry(Panel):
         self.focus = False
         self.selecting = False
         self.time_last_click = 0
+        self._caret = 0
+        self._select_start = 0
 
     @property
     def font(self):
@@ -73,6 +73,56 @@ class TextEntry(Panel):
         self._font = _font
         self.request_render()
 
+    @property
+    def caret(self):
+        return self._caret
+
+    @caret.setter
+    def caret(self, caret):
+        if caret != self._caret:
+            selection = self.selection_rect()
+            self._caret = caret
+            self.selection_changed(selection)
+
+    @property
+    def select_start(self):
+        return self._select_start
+
+    @select_start.setter
+    def select_start(self, select_start):
+        if select_start != self._select_start:
+            selection = self.selection_rect()
+            self._select_start = select_start
+            self.selection_changed(selection)
+
+    def scroll_to_caret(self):
+        _, _, startx, _ = self.font.get_rect(self.text[:self.caret])
+        if self.caret == 0:
+            self.viewx = -self.xoffset
+        else:
+            if startx - self.viewx > self.width:
+                self.viewx = startx - int(self.width * 0.66)
+            if startx - self.viewx < 0:
+                self.viewx = startx - int(self.width * 0.33)
+            self.viewx = max(self.viewx, -self.xoffset)
+
+    def selection_rect(self):
+        # Local region covered by the caret or the selection, padded for
+        # glyphs overhanging the selection edges.
+        start, end = sorted((self.caret, self.select_start))
+        _, _, startx, _ = self.font.get_rect(self.text[:start])
+        _, _, endx, _ = self.font.get_rect(self.text[:end])
+        return pygame.Rect(startx - self.viewx - 2, 0, endx - startx + 5, self.height)
+
+    def selection_changed(self, selection):
+        # Scrolling the view redraws the whole entry, otherwise only the old
+        # and new selection regions are redrawn.
+        viewx = self.viewx
+        self.scroll_to_caret()
+        if self.viewx == viewx:
+            self.request_render(selection)
+            self.request_render(self.selection_rect())
+
     def cursor_to_caret(self, cursor_x, cursor_y=0):
         absolute_mx = cursor_x + self.viewx
         caret = 0
@@ -91,6 +141,8 @@ class TextEntry(Panel):
         return caret
 
     def mouse_press(self, event):
+        if event.button != 1:
+            return
         double_click_speed = 0.4
         time = Clock.time()
         if event.hover and len(self.text) > 0:
@@ -99,6 +151,8 @@ class TextEntry(Panel):
                 self.caret = self.cursor_to_caret(event.x, event.y)
                 self.select_start = self.caret
                 self.selecting = True
+                # Selecting follows the mouse outside of the entry.
+                event.gui.capture_pointer(self)
             #Double click
             else:
                 caret = self.cursor_to_caret(event.x, event.y)
@@ -131,12 +185,14 @@ class TextEntry(Panel):
                         self.caret = len(self.text)
             self.time_last_click = time
 
-    def mouse_move(self, event):
+    def mouse_drag(self, event):
         if self.selecting:
             self.caret = self.cursor_to_caret(event.x, event.y)
 
     def mouse_release(self, event):
-        self.selecting = False
+        if self.selecting and event.button == 1:
+            self.selecting = False
+            event.gui.release_pointer()
 
     def focus_change(self, focus):
         self.focus = focus
@@ -144,6 +200,8 @@ class TextEntry(Panel):
 
     def key_press(self, event):
         if event.focus:
+            if event.key not in ignore_keys:
+                event.stop_propagation()
             ctrl = event.mod & (pygame.KMOD_LCTRL | pygame.KMOD_RCTRL)
             shift = event.mod & (pygame.KMOD_LSHIFT | pygame.KMOD_RSHIFT)
 
@@ -48,11 +48,12 @@ def setup(gui):
     scroll_panel.rect = (x, y, 200, 200)
     y += scroll_panel.height + 8
 
-    for i in range(20):
-        button = gui.create(TextButton)
-        button.parent = scroll_panel
-        button.rect = (0, i * 24, 100, 24)
-        button.text = "Button"
+    with gui.batch():
+        for i in range(20):
+            button = gui.create(TextButton)
+            button.parent = scroll_panel
+            button.rect = (0, i * 24, 100, 24)
+            button.text = "Button"
 
     adjustable_divider = gui.create(AdjustableDivider, column_count=4, row_count=3)
     adjustable_divider.rect = (x, y, 200, 200)
@@ -72,17 +73,17 @@ def main():
 
     running = True
     while running:
+        events = []
         for event in pygame.event.get():
             if event.type == pygame.QUIT:
                 running = False
             elif event.type == pygame.KEYDOWN and event.key == pygame.K_ESCAPE:
                 running = False
             else:
-                gui.event(event)
-        screen.fill((30, 30, 30))
+                events.append(event)
+        gui.events(events)
         gui.layout(screen.get_width(), screen.get_height())
-        gui.render(screen, clock)
-        pygame.display.flip()
+        pygame.display.update(gui.render(screen, clock))
         clock.tick()
 
 if __name__ == "__main__":